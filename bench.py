@@ -0,0 +1,319 @@
+"""Local load benchmark for julu.py.
+
+Runs the app in-process against a throwaway SQLite database, projects folder
+and storage directory, drives it from a pool of threads and reports
+throughput and p50/p95/p99 latency per operation:
+
+    python bench.py                         # run, compare with bench_baseline.json if present
+    python bench.py --save-baseline         # run and store the result as the new baseline
+    python bench.py --scenario read --threads 16 --duration 10
+
+Scenarios:
+    auth    concurrent signups, then repeated logins
+    deploy  bursts of editor deploys, sent as the editor's delta uploads, timed
+            until the background job is done
+    read    read-heavy traffic: deployed pages and assets, the IDE shell,
+            the session fragment and the project list
+
+A run is flagged as a regression (exit status 1) when an operation's p95 is
+more than --tolerance slower, or its throughput that much lower, than in the
+baseline. Baselines are machine-specific; record one on the machine you
+compare on.
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+REPO = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE = os.path.join(REPO, 'bench_baseline.json')
+
+
+def load_app(workdir):
+    """Builds an app whose database and storage live inside `workdir`."""
+    sys.path.insert(0, REPO)
+    import julu
+    unlimited = (10 ** 9, 10 ** 9)  # every client is 127.0.0.1: measure logins, not the throttle
+    app = julu.create_app({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(workdir, 'bench.db'),
+        'STORAGE_PATH': os.path.join(workdir, 'storage'),
+        'DEPLOY_LOCK_PATH': os.path.join(workdir, 'deploy-locks'),
+        'LOGIN_RATE_LIMIT_IP': unlimited,
+        'LOGIN_RATE_LIMIT_USERNAME': unlimited,
+        'SIGNUP_RATE_LIMIT_IP': unlimited,
+        'PASSWORD_QUEUE': 64,  # let every bench thread wait for a hash instead of getting a 503
+    })
+    with app.app_context():
+        julu.db.create_all()
+        julu.upgrade_schema()
+    return app
+
+
+class Recorder:
+    """Collects latencies per operation, thread-safely."""
+
+    def __init__(self):
+        self.samples = {}
+        self.errors = {}
+        self.lock = threading.Lock()
+
+    def timed(self, op, func, ok=lambda response: response.status_code < 400):
+        started = time.perf_counter()
+        response = func()
+        elapsed = time.perf_counter() - started
+        with self.lock:
+            if ok(response):
+                self.samples.setdefault(op, []).append(elapsed)
+            else:
+                self.errors[op] = self.errors.get(op, 0) + 1
+        return response
+
+    def add(self, op, elapsed):
+        with self.lock:
+            self.samples.setdefault(op, []).append(elapsed)
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, int(round(p / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def summarize(recorder, wall_seconds):
+    results = {}
+    for op in sorted(set(recorder.samples) | set(recorder.errors)):
+        values = sorted(recorder.samples.get(op, []))
+        results[op] = {
+            'count': len(values),
+            'errors': recorder.errors.get(op, 0),
+            'throughput': round(len(values) / wall_seconds, 2) if wall_seconds else 0.0,
+            'p50_ms': round(percentile(values, 50) * 1000, 3),
+            'p95_ms': round(percentile(values, 95) * 1000, 3),
+            'p99_ms': round(percentile(values, 99) * 1000, 3),
+        }
+    return results
+
+
+def run_threads(threads, target):
+    """Runs target(worker_index) on `threads` threads; returns wall time."""
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        for future in [pool.submit(target, i) for i in range(threads)]:
+            future.result()
+    return time.perf_counter() - started
+
+
+def signup_and_login(app, recorder, username, password='bench-password'):
+    client = app.test_client()
+    recorder.timed('signup', lambda: client.post('/signup', data={'username': username, 'password': password}),
+                   ok=lambda r: r.status_code == 302)
+    recorder.timed('login', lambda: client.post('/login', data={'username': username, 'password': password}),
+                   ok=lambda r: r.status_code == 302)
+    return client
+
+
+def site_fields(seed):
+    return {
+        'project_name': f'site-{seed}',
+        'html_code': f'<h1>Bench {seed}</h1>\n' + '<p>Lorem ipsum dolor sit amet.</p>\n' * 50,
+        'css_code': 'body { font-family: sans-serif; }\n' + f'.c{seed} {{ color: #333; }}\n' * 40,
+        'js_code': f'console.log("bench {seed}");\n' + 'function f(a, b) { return a + b; }\n' * 40,
+    }
+
+
+def editor_form(fields, deployed):
+    """The form the editor posts for `fields`: sha256 hashes of the text as typed,
+    only the fields not in `deployed` ({field: hash} of the client's last deploy),
+    and CRLF line endings, as browsers encode multipart/form-data."""
+    hashes = {field: hashlib.sha256(value.encode('utf-8')).hexdigest()
+              for field, value in fields.items() if field.endswith('_code')}
+    form = {'project_name': fields['project_name'], 'hashes': json.dumps(hashes)}
+    for field, digest in hashes.items():
+        if deployed.get(field) != digest:
+            form[field] = fields[field].replace('\n', '\r\n')
+    return form, hashes
+
+
+def deploy(client, recorder, fields, deployed=None, timeout=30):
+    """Posts a deploy and waits for its job; records both the request and the job.
+
+    With `deployed`, unchanged fields are left out as the editor does; the
+    server asking for them again (409) counts as a deploy_api error.
+    """
+    started = time.perf_counter()
+    form, hashes = editor_form(fields, deployed if deployed is not None else {})
+    response = recorder.timed('deploy_api', lambda: client.post('/deploy_api', data=form),
+                              ok=lambda r: r.status_code == 202)
+    if response.status_code != 202:
+        return False
+    status_url = response.get_json()['status_url']
+    deadline = started + timeout
+    while time.perf_counter() < deadline:
+        job = client.get(status_url).get_json()['job']
+        if job['status'] in ('done', 'failed'):
+            if job['status'] == 'done':
+                recorder.add('deploy_job', time.perf_counter() - started)
+                if deployed is not None:
+                    deployed.update(hashes)
+                return True
+            break
+        time.sleep(0.01)
+    with recorder.lock:
+        recorder.errors['deploy_job'] = recorder.errors.get('deploy_job', 0) + 1
+    return False
+
+
+def scenario_auth(app, args):
+    recorder = Recorder()
+    run_id = os.getpid()
+
+    def worker(index):
+        for n in range(args.users):
+            client = signup_and_login(app, recorder, f'auth-{run_id}-{index}-{n}')
+            for _ in range(args.logins):
+                recorder.timed('login', lambda: client.post(
+                    '/login', data={'username': f'auth-{run_id}-{index}-{n}', 'password': 'bench-password'}),
+                    ok=lambda r: r.status_code == 302)
+
+    return summarize(recorder, run_threads(args.threads, worker))
+
+
+def scenario_deploy(app, args):
+    recorder = Recorder()
+    setup = Recorder()
+    clients = [signup_and_login(app, setup, f'deployer-{i}') for i in range(args.threads)]
+
+    def worker(index):
+        deployed = {}  # per project: what the client last deployed
+        for n in range(args.deploys):
+            fields = site_fields(f'{index}-{n % 3}')  # redeploys hit the delta/unchanged paths too
+            fields['js_code'] += f'// burst {n}\n'
+            deploy(clients[index], recorder, fields, deployed.setdefault(fields['project_name'], {}))
+
+    return summarize(recorder, run_threads(args.threads, worker))
+
+
+def scenario_read(app, args):
+    setup = Recorder()
+    owner = signup_and_login(app, setup, 'reader-owner')
+    sites = []
+    for n in range(args.sites):
+        fields = site_fields(n)
+        deploy(owner, setup, fields)
+        sites.append(f"/reader-owner/{fields['project_name']}")
+    paths = [(op, site + suffix) for site in sites
+             for op, suffix in (('view_project', ''), ('view_project_files', '/style.css'),
+                                ('view_project_files', '/script.js'))]
+
+    recorder = Recorder()
+    deadline = time.perf_counter() + args.duration
+
+    def worker(index):
+        rng = random.Random(index)
+        visitor = app.test_client()
+        user = signup_and_login(app, setup, f'reader-{index}') if index % 4 == 0 else None
+        while time.perf_counter() < deadline:
+            if user is not None and rng.random() < 0.2:
+                op, path = rng.choice([('ide_home', '/'), ('ide_session', '/ide/session'),
+                                       ('api_projects', '/api/projects')])
+                recorder.timed(op, lambda: user.get(path))
+            else:
+                op, path = rng.choice(paths)
+                recorder.timed(op, lambda: visitor.get(path, headers={'Accept-Encoding': 'gzip'}))
+
+    return summarize(recorder, run_threads(args.threads, worker))
+
+
+SCENARIOS = {'auth': scenario_auth, 'deploy': scenario_deploy, 'read': scenario_read}
+
+
+def compare(results, baseline, tolerance):
+    """Returns human-readable regressions of `results` against `baseline`."""
+    regressions = []
+    for scenario, ops in results.items():
+        for op, current in ops.items():
+            before = baseline.get(scenario, {}).get(op)
+            if not before or not before['count']:
+                continue
+            if current['p95_ms'] > before['p95_ms'] * (1 + tolerance):
+                regressions.append(f"{scenario}/{op}: p95 {before['p95_ms']} -> {current['p95_ms']} ms")
+            if current['throughput'] < before['throughput'] * (1 - tolerance):
+                regressions.append(f"{scenario}/{op}: throughput {before['throughput']} -> {current['throughput']} /s")
+            if current['errors'] > before['errors']:
+                regressions.append(f"{scenario}/{op}: errors {before['errors']} -> {current['errors']}")
+    return regressions
+
+
+def print_results(results):
+    print(f"{'operation':<32}{'count':>8}{'errors':>8}{'ops/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for scenario, ops in results.items():
+        for op, r in ops.items():
+            print(f"{scenario + '/' + op:<32}{r['count']:>8}{r['errors']:>8}{r['throughput']:>10}"
+                  f"{r['p50_ms']:>10}{r['p95_ms']:>10}{r['p99_ms']:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenario', choices=sorted(SCENARIOS), action='append',
+                        help='Scenario to run (repeatable; default: all).')
+    parser.add_argument('--threads', type=int, default=8, help='Concurrent clients per scenario.')
+    parser.add_argument('--users', type=int, default=5, help='auth: signups per thread.')
+    parser.add_argument('--logins', type=int, default=10, help='auth: extra logins per signed-up user.')
+    parser.add_argument('--deploys', type=int, default=10, help='deploy: deploys per thread.')
+    parser.add_argument('--sites', type=int, default=10, help='read: deployed sites to read from.')
+    parser.add_argument('--duration', type=float, default=5.0, help='read: seconds of traffic.')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='Baseline JSON to compare with.')
+    parser.add_argument('--save-baseline', action='store_true', help='Write the results to --baseline.')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed relative slowdown.')
+    parser.add_argument('--output', help='Also write the results as JSON here.')
+    parser.add_argument('--keep', action='store_true', help='Keep the temporary working directory.')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='julu-bench-')
+    try:
+        app = load_app(workdir)
+        results = {}
+        for name in args.scenario or sorted(SCENARIOS):
+            print(f"running {name}...", file=sys.stderr)
+            results[name] = SCENARIOS[name](app, args)
+    finally:
+        if args.keep:
+            print(f"working directory kept at {workdir}", file=sys.stderr)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print_results(results)
+    document = {'created_at': time.time(), 'args': vars(args), 'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(document, f, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(document, f, indent=2)
+        print(f"baseline saved to {args.baseline}")
+        return 0
+    if not os.path.exists(args.baseline):
+        print("no baseline to compare with (use --save-baseline)")
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)['results']
+    regressions = compare(results, baseline, args.tolerance)
+    for line in regressions:
+        print("REGRESSION " + line)
+    if not regressions:
+        print(f"no regressions against {args.baseline} (tolerance {args.tolerance:.0%})")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
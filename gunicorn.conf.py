@@ -0,0 +1,34 @@
+# gunicorn -c gunicorn.conf.py
+#
+# The app is imported once in the parent (preload_app), which compiles the
+# templates and renders the IDE shell before forking; each worker then drops
+# the inherited database connections and starts its own thread pools.
+import os
+
+import julu
+
+wsgi_app = 'julu:create_app()'
+preload_app = True
+# Loopback only: meant to sit behind a reverse proxy (nginx, Caddy, ...) that
+# sets X-Forwarded-For. The app then trusts one proxy hop for client addresses
+# (TRUSTED_PROXIES, used by the login/signup limits); set JULU_TRUSTED_PROXIES
+# to the real number of proxies, or 0 when clients connect directly.
+bind = os.environ.get('BIND', '127.0.0.1:8000')
+if bind.startswith(('127.0.0.1:', 'localhost:', '[::1]:')):
+    os.environ.setdefault('JULU_TRUSTED_PROXIES', '1')
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+
+
+def when_ready(server):
+    app = server.app.wsgi()
+    julu.warm_up(app)
+    # Logins waiting for a password hash hold their request thread
+    password_threads = app.config['PASSWORD_WORKERS'] + app.config['PASSWORD_QUEUE']
+    if password_threads >= threads:
+        server.log.warning("PASSWORD_WORKERS + PASSWORD_QUEUE (%d) >= threads (%d): a burst of logins "
+                           "can take every thread that serves sites", password_threads, threads)
+
+
+def post_fork(server, worker):
+    julu.reset_after_fork(server.app.wsgi())
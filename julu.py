@@ -1,33 +1,255 @@
-from flask import Flask, request, redirect, url_for, send_from_directory, render_template_string, session, flash, jsonify
+from flask import Flask, Blueprint, current_app, request, redirect, url_for, abort, render_template, make_response, send_file, session, flash, jsonify, g, has_app_context
+from flask import before_render_template, template_rendered
 from flask_sqlalchemy import SQLAlchemy
+from markupsafe import escape
+from sqlalchemy import event, text
+from sqlalchemy.exc import IntegrityError
+import click
+from jinja2 import DictLoader
+from werkzeug.local import LocalProxy
+from werkzeug.middleware.proxy_fix import ProxyFix
+from werkzeug.security import safe_join, generate_password_hash, check_password_hash
 import os
+import io
+import base64
+import sys
 import json
+import sqlite3
+import gzip
+import hashlib
+import mimetypes
+import re
+import functools
+import tempfile
+import zipfile
+import tarfile
+import zlib
+import threading
+import time
+import struct
+import mmap
+import fcntl
+import contextlib
+import secrets
+import shutil
+import urllib.request
+import weakref
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-app = Flask(__name__)
-app.secret_key = 'supersecretkey'  # Change this in production
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///launchpad.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+try:
+    import brotli  # optional, enables .br variants of deployed files
+except ImportError:
+    brotli = None
+
+try:
+    import rjsmin  # optional, enables the minify_js deploy stage
+except ImportError:
+    rjsmin = None
 
-db = SQLAlchemy(app)
 PROJECTS_FOLDER = 'projects'
+ROOT_PATH = os.path.dirname(os.path.abspath(__file__))
+
+db = SQLAlchemy()
+# Routes, hooks and CLI commands; create_app() registers them on an app
+bp = Blueprint('julu', __name__, cli_group=None)
+
+def runtime():
+    """The current app's caches, pools, limiters and storage (see Runtime)."""
+    return current_app.extensions['julu']
+
+def runtime_proxy(name):
+    # Module-level name for a per-app object, looked up on each use
+    return LocalProxy(lambda: getattr(runtime(), name))
+
+def load_config(app):
+    """Default settings. Most can be set from the environment, and any of them
+    with a JULU_ prefix (JULU_DEPLOY_WORKERS=4), or passed to create_app()."""
+    app.secret_key = os.environ.get('SECRET_KEY', 'supersecretkey')  # Change this in production
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///launchpad.db')
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    # Connection pool per worker process; SQLite allows one writer at a time
+    # anyway, so a small pool is enough and keeps file handles down.
+    # (Only used for file databases, see create_app.)
+    app.config['DB_POOL_OPTIONS'] = {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 5)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 5)),
+        'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', 30)),
+        'pool_recycle': 3600,
+    }
+    # Applied to every new SQLite connection (see set_sqlite_pragmas)
+    app.config['SQLITE_PRAGMAS'] = {
+        'journal_mode': 'WAL',  # readers never block the writer, and vice versa
+        'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000)),  # wait for the lock instead of "database is locked"
+        'synchronous': 'NORMAL',  # durable with WAL, without an fsync per commit
+        'cache_size': -16000,  # 16 MB page cache per connection
+        'temp_store': 'MEMORY',
+    }
+
+    # Cache-Control for deployed files, by extension ('' is the fallback)
+    app.config['DEPLOY_CACHE_CONTROL'] = {
+        '.html': 'public, no-cache',
+        '.css': 'public, max-age=300',
+        '.js': 'public, max-age=300',
+        '': 'public, max-age=60',
+    }
+
+    # How long user records and project lists are cached per worker
+    app.config['IDENTITY_CACHE_TTL'] = 30
+    app.config['IDENTITY_CACHE_MAX_ENTRIES'] = 10000
+    # In-process cache of hot deployed files (see SiteCache)
+    app.config['SITE_CACHE_MAX_ENTRIES'] = 2048
+    app.config['SITE_CACHE_MAX_BYTES'] = 64 * 1024 * 1024
+    # Other workers learn about a redeploy by re-checking the manifest this often
+    app.config['SITE_CACHE_REVALIDATE_SECONDS'] = 2.0
+
+    # 'directory' keeps the plain projects/<username>/<project> layout,
+    # 'cas' is the deduplicated segment store (see ContentAddressedStorage).
+    # Convert an existing tree with: flask --app julu migrate-storage
+    app.config['STORAGE_BACKEND'] = os.environ.get('STORAGE_BACKEND', 'directory')
+    # Deploy build stages, run in this order by a pool of DEPLOY_WORKERS threads.
+    # 'minify_html' is also available but off: collapsing whitespace breaks
+    # anything a stylesheet sets to white-space: pre.
+    app.config['DEPLOY_PIPELINE'] = ['minify_css', 'minify_js', 'hash_assets', 'compress']
+    app.config['DEPLOY_WORKERS'] = int(os.environ.get('DEPLOY_WORKERS', 2))
+    # Jobs still queued or running this many seconds after they were created
+    # are marked failed: the worker process that owned them is gone
+    app.config['DEPLOY_JOB_TIMEOUT'] = int(os.environ.get('DEPLOY_JOB_TIMEOUT', 600))
+    # Lock files that serialize deploys of a project across worker processes
+    # (same host); defaults to <instance path>/deploy-locks, see create_app
+    app.config['DEPLOY_LOCK_PATH'] = os.environ.get('DEPLOY_LOCK_PATH')
+    # Used instead of DEPLOY_CACHE_CONTROL when the URL carries the file's ?v= hash
+    app.config['DEPLOY_IMMUTABLE_CACHE_CONTROL'] = 'public, max-age=31536000, immutable'
+    # Limits for /upload_api archives: request body, extracted bytes, file count
+    app.config['UPLOAD_MAX_BYTES'] = 50 * 1024 * 1024
+    app.config['UPLOAD_MAX_TOTAL_SIZE'] = 200 * 1024 * 1024
+    app.config['UPLOAD_MAX_FILES'] = 2000
+    app.config['UPLOAD_STAGING_PATH'] = None  # system temp dir
+    # Deploys kept per project for rollback; older ones are garbage-collected
+    app.config['DEPLOY_KEEP_VERSIONS'] = 5
+    # Defaults to PROJECTS_FOLDER for 'directory' and 'storage' for 'cas' (see create_app)
+    app.config['STORAGE_PATH'] = os.environ.get('STORAGE_PATH')
 
-if not os.path.exists(PROJECTS_FOLDER):
-    os.makedirs(PROJECTS_FOLDER)
+    # Password KDF and its work factor ("scrypt:N:r:p" or "pbkdf2:sha256:iterations").
+    # Stored hashes made with other settings are upgraded on the next login.
+    app.config['PASSWORD_HASH_METHOD'] = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+    # Hashing runs on this many threads per worker, and at most PASSWORD_QUEUE
+    # more logins may wait for one; any login beyond that gets a 503 at once.
+    # A waiting login holds its request thread, so keep the sum below the
+    # server's threads per worker (gunicorn.conf.py warns otherwise).
+    app.config['PASSWORD_WORKERS'] = int(os.environ.get('PASSWORD_WORKERS', 2))
+    app.config['PASSWORD_QUEUE'] = int(os.environ.get('PASSWORD_QUEUE', 0))
+    # Reverse proxies in front of the app that append to X-Forwarded-For. The
+    # per-IP limits below (and the /metrics loopback check) need the real
+    # client address; with 0, remote_addr is taken as is. Never set it higher
+    # than the proxies actually there, or clients can pick their own address.
+    app.config['TRUSTED_PROXIES'] = int(os.environ.get('TRUSTED_PROXIES', 0))
+    # Token buckets in front of /login and /signup: (burst, refills per second)
+    app.config['LOGIN_RATE_LIMIT_IP'] = (20, 0.5)
+    app.config['LOGIN_RATE_LIMIT_USERNAME'] = (5, 0.1)
+    app.config['SIGNUP_RATE_LIMIT_IP'] = (5, 0.05)
+
+    # Source files larger than this are left out of code search, in characters
+    app.config['SEARCH_MAX_FILE_CHARS'] = 1024 * 1024
+
+    # Largest editor draft accepted by /api/drafts, in characters
+    app.config['DRAFT_MAX_CHARS'] = 2 * 1024 * 1024
+
+    # Requests slower than this are logged with a DB/template breakdown (unset: off)
+    app.config['SLOW_REQUEST_SECONDS'] = float(os.environ['SLOW_REQUEST_SECONDS']) if os.environ.get('SLOW_REQUEST_SECONDS') else None
+    # If set, /metrics and /api/cache_stats require "Authorization: Bearer <token>";
+    # if not, they only answer loopback clients, and only with TRUSTED_PROXIES set:
+    # without it a proxy on the same host makes every visitor look local
+    app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')
+
+    # Fingerprinted front-end bundle written by `flask build-assets`, served under /assets/
+    app.config['ASSETS_PATH'] = os.path.join(app.root_path, 'static', 'dist')
 
 # -------------------- DATABASE MODELS --------------------
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
-    password = db.Column(db.String(120), nullable=False)
+    password = db.Column(db.String(255), nullable=False)  # werkzeug hash, see PASSWORDS
     projects = db.relationship('Project', backref='owner', lazy=True)
 
 class Project(db.Model):
+    # home(), deploys and the project APIs all look projects up by owner and name
+    __table_args__ = (db.Index('ix_project_user_name', 'user_id', 'name', unique=True),)
+
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
 
-with app.app_context():
-    db.create_all()
+class DeployJob(db.Model):
+    id = db.Column(db.String(32), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    project_name = db.Column(db.String(100), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, done, failed
+    stages = db.Column(db.Text, nullable=False, default='[]')  # JSON: [{'name', 'ms'}]
+    result = db.Column(db.Text)  # JSON: {'url', 'updated'}
+    error = db.Column(db.Text)
+    created_at = db.Column(db.Float, nullable=False, default=time.time)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'project_name': self.project_name,
+            'status': self.status,
+            'stages': json.loads(self.stages),
+            'result': json.loads(self.result) if self.result else None,
+            'error': self.error,
+        }
+
+class Draft(db.Model):
+    # Autosaved editor content, one row per user, project and tab (see DRAFTS)
+    __table_args__ = (db.Index('ix_draft_user_project_field', 'user_id', 'project_name', 'field', unique=True),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    project_name = db.Column(db.String(100), nullable=False)
+    field = db.Column(db.String(10), nullable=False)  # html, css, js
+    content = db.Column(db.Text, nullable=False, default='')
+    version = db.Column(db.Integer, nullable=False, default=1)  # bumped on every save
+    updated_at = db.Column(db.Float, nullable=False, default=time.time)
+
+class SearchFile(db.Model):
+    # One row per indexed source file; its chunks live in the search_chunk
+    # FTS5 table under rowids derived from this id (see SEARCH)
+    __table_args__ = (db.Index('ix_search_file_user_project_name', 'user_id', 'project_name', 'filename', unique=True),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    project_name = db.Column(db.String(100), nullable=False)
+    filename = db.Column(db.String(255), nullable=False)
+    content_hash = db.Column(db.String(64), nullable=False)  # of the indexed source
+
+def set_sqlite_pragmas(pragmas, dbapi_connection, connection_record):
+    """'connect' listener that create_app() adds to each engine."""
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    for pragma, value in pragmas.items():
+        cursor.execute(f"PRAGMA {pragma} = {value}")
+    cursor.close()
+
+# Bumped whenever upgrade_schema() learns a new step; stored in PRAGMA user_version
+SCHEMA_VERSION = 2
+
+def upgrade_schema():
+    """Brings a database created by an older version up to SCHEMA_VERSION."""
+    if db.engine.dialect.name != 'sqlite':
+        return
+    with db.engine.begin() as conn:
+        version = conn.exec_driver_sql('PRAGMA user_version').scalar()
+        if version < 1:
+            # Older deploys could race and insert the same project twice
+            conn.exec_driver_sql('DELETE FROM project WHERE id NOT IN '
+                                 '(SELECT MIN(id) FROM project GROUP BY user_id, name)')
+            conn.exec_driver_sql('CREATE UNIQUE INDEX IF NOT EXISTS ix_project_user_name ON project (user_id, name)')
+        if version < 2:
+            conn.exec_driver_sql(SEARCH_TABLE_SQL)
+        if version < SCHEMA_VERSION:
+            conn.exec_driver_sql(f'PRAGMA user_version = {SCHEMA_VERSION}')
 
 # -------------------- TEMPLATES --------------------
 
@@ -39,7 +261,7 @@ AUTH_HTML = """
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>Julu's Cloud IDE</title>
-    <script src="https://cdn.tailwindcss.com"></script>
+    <link rel="stylesheet" href="{{ asset_url('app.css') }}">
     <style>
         body { font-family: 'Inter', sans-serif; background-color: #111827; color: white; }
     </style>
@@ -91,14 +313,12 @@ IDE_HTML = """
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0, maximum-scale=1.0, user-scalable=no">
     <title>Julu's Cloud IDE</title>
-    <!-- Tailwind CSS -->
-    <script src="https://cdn.tailwindcss.com"></script>
+    <!-- Purged utility CSS and the Inter font (static/src/app.css) -->
+    <link rel="stylesheet" href="{{ asset_url('app.css') }}">
     <!-- Monaco Editor -->
-    <script src="https://cdnjs.cloudflare.com/ajax/libs/monaco-editor/0.44.0/min/vs/loader.min.js"></script>
-    <!-- Google Fonts -->
-    <link href="https://fonts.googleapis.com/css2?family=Inter:wght@400;600;700&family=Fira+Code&display=swap" rel="stylesheet">
+    <script src="{{ asset_url('monaco', 'loader.js') }}"></script>
     <!-- FontAwesome -->
-    <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.0.0/css/all.min.css">
+    <link rel="stylesheet" href="{{ asset_url('fontawesome') }}">
     
     <style>
         body { background-color: #1e1e1e; color: white; overflow: hidden; height: 100dvh; width: 100vw; font-family: 'Inter', sans-serif; }
@@ -113,6 +333,8 @@ IDE_HTML = """
         /* Sidebar Animation */
         .sidebar { position: absolute; left: 0; top: 0; bottom: 0; width: 260px; background: #262626; transform: translateX(-100%); transition: transform 0.3s; z-index: 60; border-right: 1px solid #3e3e3e; }
         .sidebar.open { transform: translateX(0); }
+        .search-hit .snippet { white-space: pre-wrap; word-break: break-all; }
+        .search-hit mark { background: rgba(168, 85, 247, 0.4); color: white; border-radius: 2px; }
     </style>
 </head>
 <body class="flex flex-col">
@@ -153,26 +375,14 @@ IDE_HTML = """
             <h2 class="text-sm font-bold text-gray-400 uppercase tracking-wider">My Projects</h2>
             <button onclick="toggleSidebar()" class="text-gray-500 hover:text-white"><i class="fas fa-times"></i></button>
         </div>
-        <div class="flex-1 overflow-y-auto space-y-2">
-            {% for project in projects %}
-            <a href="/{{ user.username }}/{{ project.name }}" target="_blank" class="block p-3 rounded bg-[#333] hover:bg-[#444] text-sm text-gray-200 border border-transparent hover:border-purple-500 transition">
-                <div class="flex justify-between items-center">
-                    <span>{{ project.name }}</span>
-                    <i class="fas fa-external-link-alt text-xs text-gray-500"></i>
-                </div>
-            </a>
-            {% endfor %}
-            {% if not projects %}
-            <p class="text-xs text-gray-500 text-center mt-10">No projects yet.<br>Click Deploy to create one!</p>
-            {% endif %}
-        </div>
-        <div class="mt-4 pt-4 border-t border-gray-700">
-            <div class="flex items-center gap-3 mb-4 px-2">
-                <div class="w-8 h-8 rounded-full bg-gradient-to-r from-blue-500 to-purple-500 flex items-center justify-center text-xs font-bold">{{ user.username[0]|upper }}</div>
-                <span class="text-sm font-medium">{{ user.username }}</span>
-            </div>
-            <a href="/logout" class="block w-full text-center py-2 bg-red-500/10 text-red-400 rounded hover:bg-red-500/20 text-xs font-bold transition">Logout</a>
-        </div>
+        <input id="code-search" type="search" placeholder="Search code..." class="w-full mb-2 bg-[#333] border border-gray-600 rounded p-2 text-sm text-white focus:border-purple-500 outline-none">
+        <input id="project-filter" type="text" placeholder="Filter projects..." class="w-full mb-3 bg-[#333] border border-gray-600 rounded p-2 text-sm text-white focus:border-purple-500 outline-none">
+        <!-- Filled page by page from /api/projects the first time the sidebar opens -->
+        <div id="project-list" class="flex-1 overflow-y-auto space-y-2"></div>
+        <!-- Hits from /api/search; replaces the project list while there is a query -->
+        <div id="search-results" class="flex-1 overflow-y-auto space-y-2 hidden"></div>
+        <!-- Per-user part, loaded from /ide/session so the shell stays static -->
+        <div id="sidebar-session"></div>
     </div>
     
     <!-- MAIN EDITOR AREA -->
@@ -193,10 +403,15 @@ IDE_HTML = """
     <div id="deploy-modal" class="modal-overlay">
         <div class="bg-[#2d2d2d] p-6 rounded-xl w-80 shadow-2xl border border-gray-700">
             <h3 class="text-xl font-bold mb-4 text-green-400"><i class="fas fa-rocket mr-2"></i>Deploy to Cloud</h3>
-            <p class="text-xs text-gray-400 mb-4">Your site will be live at: <br><span class="text-blue-400 font-mono">/{{ user.username }}/project-name</span></p>
+            <p class="text-xs text-gray-400 mb-4">Your site will be live at: <br><span class="text-blue-400 font-mono">/<span class="js-username"></span>/project-name</span></p>
             
             <input type="text" id="deploy-name" placeholder="Enter Project Name (e.g., portfolio)" 
                    class="w-full bg-[#1e1e1e] border border-gray-600 rounded p-3 text-white text-sm outline-none focus:border-green-500 mb-4">
+
+            <label class="block text-xs text-gray-400 mb-4 cursor-pointer hover:text-white">
+                <i class="fas fa-file-archive mr-1"></i> Or upload a .zip / .tar.gz of a whole site
+                <input type="file" id="deploy-archive" accept=".zip,.tar,.tar.gz,.tgz" class="hidden" onchange="uploadArchive(this.files[0])">
+            </label>
             
             <div class="flex gap-2">
                 <button onclick="closeDeployModal()" class="flex-1 py-2 bg-gray-600 rounded text-sm font-bold hover:bg-gray-500">Cancel</button>
@@ -238,7 +453,7 @@ IDE_HTML = """
         </div>
         <div id="chat-box" class="flex-1 p-4 overflow-y-auto space-y-3">
             <div class="bg-[#333] p-3 rounded-lg w-3/4 rounded-tl-none text-sm text-gray-200">
-                Hello {{ user.username }}! I can help you write code. Just ask me to "Create a portfolio" or "Fix my CSS".
+                Hello <span class="js-username"></span>! I can help you write code. Just ask me to "Create a portfolio" or "Fix my CSS".
             </div>
         </div>
         <div class="p-3 bg-[#262626] border-t border-[#3e3e3e] flex gap-2">
@@ -251,15 +466,118 @@ IDE_HTML = """
     <script>
         // --- EDITOR SETUP ---
         const files = {
-            html: { content: "<h1>Welcome {{ user.username }}</h1>\\n<p>Start coding...</p>", language: 'html' },
+            html: { content: "<h1>Welcome</h1>\\n<p>Start coding...</p>", language: 'html' },
             css: { content: "body { font-family: sans-serif; background: #f0f0f0; padding: 20px; }\\nh1 { color: #333; }", language: 'css' },
             js: { content: "console.log('Hello Cloud IDE');", language: 'javascript' }
         };
         let currentTab = 'html';
         let editor = null;
 
-        require.config({ paths: { 'vs': 'https://cdnjs.cloudflare.com/ajax/libs/monaco-editor/0.44.0/min/vs' }});
-        require(['vs/editor/editor.main'], function() {
+        // --- SESSION (username + project list) ---
+        async function loadSession() {
+            const response = await fetch('/ide/session', { credentials: 'same-origin' });
+            if(response.status === 401) { location.href = '/login'; return; }
+            document.getElementById('sidebar-session').outerHTML = await response.text();
+            const username = document.getElementById('ide-session').dataset.username;
+            document.querySelectorAll('.js-username').forEach(el => el.textContent = username);
+            files.html.content = `<h1>Welcome ${username}</h1>\\n<p>Start coding...</p>`;
+        }
+
+        // --- DRAFT AUTOSAVE ---
+        // Each tab is saved server-side as a draft. Edits are queued as Monaco
+        // change events and sent in debounced batches against the last version
+        // the server acknowledged; `null` in pending means "send the whole file".
+        const drafts = { project: 'untitled', versions: { html: 0, css: 0, js: 0 }, pending: { html: [], css: [], js: [] }, inFlight: {}, timer: null, muted: false };
+
+        async function restoreDrafts() {
+            const response = await fetch('/api/drafts', { credentials: 'same-origin' });
+            if(!response.ok) return;
+            const data = await response.json();
+            drafts.project = data.project;
+            for(const [field, draft] of Object.entries(data.files)) {
+                files[field].content = draft.content;
+                drafts.versions[field] = draft.version;
+            }
+        }
+
+        function tabContent(field) {
+            return (editor && field === currentTab) ? editor.getValue() : files[field].content;
+        }
+
+        function queueDraftChanges(field, changes) {
+            // One event's changes all refer to the text before the event;
+            // applying them from the end backwards keeps every offset valid.
+            if(drafts.versions[field] === 0 && !drafts.inFlight[field]) {
+                drafts.pending[field] = null;  // nothing saved yet to patch against
+            } else if(drafts.pending[field] !== null) {
+                [...changes].sort((a, b) => b.rangeOffset - a.rangeOffset).forEach(change => drafts.pending[field].push(
+                    { rangeOffset: change.rangeOffset, rangeLength: change.rangeLength, text: change.text }));
+            }
+            clearTimeout(drafts.timer);
+            drafts.timer = setTimeout(flushDrafts, 1000);
+        }
+
+        async function flushDrafts(keepalive = false) {
+            clearTimeout(drafts.timer);
+            await Promise.all(Object.keys(drafts.pending).map(async field => {
+                const pending = drafts.pending[field];
+                if(drafts.inFlight[field] || (pending && !pending.length)) return;
+                drafts.pending[field] = [];
+                drafts.inFlight[field] = true;
+                try {
+                    await sendDraft(field, pending, keepalive);
+                } catch(e) {
+                    drafts.pending[field] = null;  // unknown outcome: resend the whole file next time
+                } finally {
+                    drafts.inFlight[field] = false;
+                }
+            }));
+        }
+
+        async function sendDraft(field, changes, keepalive, retried = false) {
+            const body = { base_version: drafts.versions[field] };
+            if(changes) body.changes = changes; else body.content = tabContent(field);
+            const response = await fetch(`/api/drafts/${encodeURIComponent(drafts.project)}/${field}`, {
+                method: 'PATCH',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify(body),
+                credentials: 'same-origin',
+                keepalive: keepalive
+            });
+            const result = await response.json();
+            if(response.ok) { drafts.versions[field] = result.version; return; }
+            if(response.status === 409 && !retried) {
+                // Saved from another tab meanwhile: what this editor shows wins
+                drafts.versions[field] = result.version;
+                drafts.pending[field] = [];
+                return sendDraft(field, null, keepalive, true);
+            }
+            throw new Error(result.error);
+        }
+
+        // After deploying under another name, keep autosaving into that project
+        async function adoptDraftProject(name) {
+            if(name === drafts.project) return;
+            await flushDrafts();
+            const response = await fetch('/api/drafts?project=' + encodeURIComponent(name), { credentials: 'same-origin' });
+            const data = await response.json();
+            drafts.project = name;
+            for(const field of Object.keys(drafts.versions)) {
+                drafts.versions[field] = data.files[field] ? data.files[field].version : 0;
+                drafts.pending[field] = null;
+            }
+            await flushDrafts();
+        }
+
+        document.addEventListener('visibilitychange', () => {
+            if(document.visibilityState === 'hidden') flushDrafts(true);
+        });
+
+        const sessionReady = loadSession().then(restoreDrafts).catch(() => {});
+
+        require.config({ paths: { 'vs': '{{ asset_url('monaco') }}' }});
+        require(['vs/editor/editor.main'], async function() {
+            await sessionReady;
             editor = monaco.editor.create(document.getElementById('monaco-host'), {
                 value: files.html.content,
                 language: 'html',
@@ -269,8 +587,9 @@ IDE_HTML = """
                 minimap: { enabled: false },
                 padding: { top: 20 }
             });
-            editor.onDidChangeModelContent(() => {
+            editor.onDidChangeModelContent((event) => {
                 files[currentTab].content = editor.getValue();
+                if(!drafts.muted) queueDraftChanges(currentTab, event.changes);
             });
         });
 
@@ -280,7 +599,9 @@ IDE_HTML = """
             document.querySelectorAll('[id^="tab-"]').forEach(el => el.className = 'tab-inactive flex-1 flex items-center justify-center gap-2 text-xs font-bold');
             document.getElementById('tab-'+type).className = 'tab-active flex-1 flex items-center justify-center gap-2 text-xs font-bold';
             if(editor) {
+                drafts.muted = true;  // loading a tab is not an edit
                 editor.setValue(files[type].content);
+                drafts.muted = false;
                 monaco.editor.setModelLanguage(editor.getModel(), files[type].language);
             }
         }
@@ -301,18 +622,180 @@ IDE_HTML = """
         function closePreview() { document.getElementById('view-preview').classList.add('hidden-view'); }
         
         // --- SIDEBAR & VIEWS ---
-        function toggleSidebar() { document.getElementById('sidebar').classList.toggle('open'); }
+        const projectList = { started: false, loading: false, cursor: null, done: false, prefix: '', generation: 0 };
+
+        function toggleSidebar() {
+            const open = document.getElementById('sidebar').classList.toggle('open');
+            if(open && !projectList.started) { projectList.started = true; loadProjects(); }
+        }
+
+        function projectLink(project) {
+            const link = document.createElement('a');
+            link.href = project.url;
+            link.target = '_blank';
+            link.className = 'block p-3 rounded bg-[#333] hover:bg-[#444] text-sm text-gray-200 border border-transparent hover:border-purple-500 transition';
+            link.innerHTML = '<div class="flex justify-between items-center"><span></span><i class="fas fa-external-link-alt text-xs text-gray-500"></i></div>';
+            link.querySelector('span').textContent = project.name;
+            return link;
+        }
+
+        // Appends the next page; the cursor is the last name we were given
+        async function loadProjects() {
+            if(projectList.loading || projectList.done) return;
+            projectList.loading = true;
+            const { prefix, generation } = projectList;
+            const params = new URLSearchParams({ limit: 50 });
+            if(projectList.cursor) params.set('after', projectList.cursor);
+            if(prefix) params.set('prefix', prefix);
+            try {
+                const response = await fetch('/api/projects?' + params, { credentials: 'same-origin' });
+                if(response.status === 401) { location.href = '/login'; return; }
+                const data = await response.json();
+                if(generation !== projectList.generation) return;  // filter changed while in flight
+                const list = document.getElementById('project-list');
+                data.projects.forEach(project => list.appendChild(projectLink(project)));
+                projectList.cursor = data.next;
+                projectList.done = !data.next;
+                if(!list.children.length) {
+                    list.innerHTML = prefix
+                        ? '<p class="text-xs text-gray-500 text-center mt-10">No matching projects.</p>'
+                        : '<p class="text-xs text-gray-500 text-center mt-10">No projects yet.<br>Click Deploy to create one!</p>';
+                }
+            } finally {
+                if(generation === projectList.generation) projectList.loading = false;
+            }
+            // Keep going until the list overflows, otherwise scroll never fires
+            const list = document.getElementById('project-list');
+            if(!projectList.done && list.scrollHeight <= list.clientHeight) loadProjects();
+        }
+
+        function resetProjects(prefix) {
+            Object.assign(projectList, { started: true, loading: false, cursor: null, done: false, prefix: prefix, generation: projectList.generation + 1 });
+            document.getElementById('project-list').innerHTML = '';
+            loadProjects();
+        }
+
+        document.getElementById('project-list').addEventListener('scroll', (event) => {
+            const list = event.target;
+            if(list.scrollTop + list.clientHeight >= list.scrollHeight - 100) loadProjects();
+        });
+
+        let filterTimer = null;
+        document.getElementById('project-filter').addEventListener('input', (event) => {
+            clearTimeout(filterTimer);
+            filterTimer = setTimeout(() => resetProjects(event.target.value.trim()), 250);
+        });
+
+        // --- CODE SEARCH ---
+        let searchTimer = null;
+        let searchGeneration = 0;
+
+        function searchHit(hit) {
+            const link = document.createElement('a');
+            link.href = hit.url;
+            link.target = '_blank';
+            link.className = 'search-hit block p-3 rounded bg-[#333] hover:bg-[#444] border border-transparent hover:border-purple-500 transition';
+            link.innerHTML = '<div class="text-xs text-gray-500 mb-1"></div><div class="snippet text-xs font-mono text-gray-200"></div>';
+            link.firstChild.textContent = `${hit.project}/${hit.file}:${hit.line}`;
+            link.lastChild.innerHTML = hit.snippet;  // escaped by the server, only <mark> added
+            return link;
+        }
+
+        async function searchCode(query) {
+            const generation = ++searchGeneration;
+            const results = document.getElementById('search-results');
+            const list = document.getElementById('project-list');
+            if(!query) {
+                results.classList.add('hidden');
+                list.classList.remove('hidden');
+                return;
+            }
+            const response = await fetch('/api/search?' + new URLSearchParams({ q: query }), { credentials: 'same-origin' });
+            if(response.status === 401) { location.href = '/login'; return; }
+            const data = await response.json();
+            if(generation !== searchGeneration) return;  // query changed while in flight
+            results.innerHTML = '';
+            (data.hits || []).forEach(hit => results.appendChild(searchHit(hit)));
+            if(!results.children.length) results.innerHTML = '<p class="text-xs text-gray-500 text-center mt-10">No matches.</p>';
+            list.classList.add('hidden');
+            results.classList.remove('hidden');
+        }
+
+        document.getElementById('code-search').addEventListener('input', (event) => {
+            clearTimeout(searchTimer);
+            searchTimer = setTimeout(() => searchCode(event.target.value.trim()), 300);
+        });
         function triggerApkView() { document.getElementById('view-apk').classList.remove('hidden-view'); }
         function closeApkView() { document.getElementById('view-apk').classList.add('hidden-view'); }
         function triggerAgent() { document.getElementById('view-agent').classList.remove('hidden-view'); }
         function closeAgent() { document.getElementById('view-agent').classList.add('hidden-view'); }
 
         // --- DEPLOYMENT LOGIC ---
-        function openDeployModal() { document.getElementById('deploy-modal').classList.add('open'); }
+        function openDeployModal() {
+            const input = document.getElementById('deploy-name');
+            if(!input.value && drafts.project !== 'untitled') input.value = drafts.project;
+            document.getElementById('deploy-modal').classList.add('open');
+        }
         function closeDeployModal() { document.getElementById('deploy-modal').classList.remove('open'); }
 
-        async function confirmDeploy() {
+        async function hashFields(fields) {
+            if(!window.crypto || !crypto.subtle) return null;  // insecure context: send everything
+            const hashes = {};
+            for(const [field, content] of Object.entries(fields)) {
+                // hash what the server stores: the form upload's CRLFs are turned back into LF
+                const text = content.replace(/\\r\\n/g, '\\n');
+                const digest = await crypto.subtle.digest('SHA-256', new TextEncoder().encode(text));
+                hashes[field] = Array.from(new Uint8Array(digest)).map(b => b.toString(16).padStart(2, '0')).join('');
+            }
+            return hashes;
+        }
+
+        // Deploys run as background jobs; poll until the job finishes or the
+        // deadline passes (the server fails jobs after DEPLOY_JOB_TIMEOUT anyway)
+        async function waitForJob(statusUrl, timeoutMs = 10 * 60 * 1000) {
+            const deadline = Date.now() + timeoutMs;
+            while(true) {
+                if(Date.now() > deadline) return { success: false, error: 'Deploy is taking too long; check the project later' };
+                const response = await fetch(statusUrl);
+                const { job, error } = await response.json();
+                if(!job) return { success: false, error: error };
+                if(job.status === 'done') return { success: true, ...job.result };
+                if(job.status === 'failed') return { success: false, error: job.error };
+                await new Promise(resolve => setTimeout(resolve, 500));
+            }
+        }
+
+        // Whole-site upload: the archive is streamed as the raw request body
+        async function uploadArchive(file) {
             const name = document.getElementById('deploy-name').value.trim();
+            if(!file) return;
+            if(!name) return alert("Please enter a project name!");
+
+            try {
+                const response = await fetch('/upload_api?project_name=' + encodeURIComponent(name), {
+                    method: 'POST',
+                    body: file
+                });
+                let result = await response.json();
+                if(result.success) result = await waitForJob(result.status_url);
+
+                if(result.success) {
+                    alert('Deployment Successful! ' + result.updated.length + ' files uploaded.');
+                    window.open(result.url, '_blank');
+                    location.reload(); // Reload to update project list
+                } else {
+                    alert('Error: ' + result.error);
+                }
+            } catch(e) {
+                alert('Upload failed: ' + e.message);
+            } finally {
+                document.getElementById('deploy-archive').value = '';
+                closeDeployModal();
+            }
+        }
+
+        async function confirmDeploy() {
+            const name = document.getElementById('deploy-name').value.trim().replace(/ /g, '-');
             if(!name) return alert("Please enter a project name!");
             
             // Sync current editor state
@@ -324,22 +807,34 @@ IDE_HTML = """
             btn.disabled = true;
 
             try {
-                const formData = new FormData();
-                formData.append('project_name', name);
-                formData.append('html_code', files.html.content);
-                formData.append('css_code', files.css.content);
-                formData.append('js_code', files.js.content);
+                const fields = { html_code: files.html.content, css_code: files.css.content, js_code: files.js.content };
+                const hashes = await hashFields(fields);
 
-                const response = await fetch('/deploy_api', {
-                    method: 'POST',
-                    body: formData
-                });
-                
-                const result = await response.json();
+                // Ask with hashes only first; the server answers with the
+                // fields it does not already have (all of them without hashes).
+                let send = hashes ? [] : Object.keys(fields);
+                let result;
+                for(let attempt = 0; attempt < 3; attempt++) {
+                    const formData = new FormData();
+                    formData.append('project_name', name);
+                    if(hashes) formData.append('hashes', JSON.stringify(hashes));
+                    send.forEach(field => formData.append(field, fields[field]));
+
+                    const response = await fetch('/deploy_api', {
+                        method: 'POST',
+                        body: formData
+                    });
+                    result = await response.json();
+                    if(response.status !== 409 || !result.needed) break;
+                    send = send.concat(result.needed);
+                }
                 
+                if(result.success) result = await waitForJob(result.status_url);
+
                 if(result.success) {
-                    alert('Deployment Successful!');
+                    alert(result.updated.length ? 'Deployment Successful! Updated: ' + result.updated.join(', ') : 'Already up to date.');
                     window.open(result.url, '_blank');
+                    await adoptDraftProject(name);
                     location.reload(); // Reload to update project list
                 } else {
                     alert('Error: ' + result.error);
@@ -375,105 +870,2772 @@ IDE_HTML = """
 </html>
 """
 
+# 3. IDE SESSION FRAGMENT (the only per-user part of the IDE page)
+IDE_SESSION_HTML = """
+<div id="ide-session" data-username="{{ user.username }}">
+    <div class="mt-4 pt-4 border-t border-gray-700">
+        <div class="flex items-center gap-3 mb-4 px-2">
+            <div class="w-8 h-8 rounded-full bg-gradient-to-r from-blue-500 to-purple-500 flex items-center justify-center text-xs font-bold">{{ user.username[0]|upper }}</div>
+            <span class="text-sm font-medium">{{ user.username }}</span>
+        </div>
+        <a href="/logout" class="block w-full text-center py-2 bg-red-500/10 text-red-400 rounded hover:bg-red-500/20 text-xs font-bold transition">Logout</a>
+    </div>
+</div>
+"""
+
+# Templates are registered once and compiled lazily by Jinja's template cache,
+# instead of being re-parsed by render_template_string on every request.
+TEMPLATES = {
+    'auth.html': AUTH_HTML,
+    'ide.html': IDE_HTML,
+    'ide_session.html': IDE_SESSION_HTML,
+}
+
+# The IDE shell has no per-user data, so it is rendered once per app (once
+# in the parent under gunicorn --preload, see warm_up) and served
+# byte-identical with a strong ETag.
+def ide_shell():
+    state = runtime()
+    if state.ide_shell is None:
+        body = render_template('ide.html').encode('utf-8')
+        state.ide_shell = (body, hashlib.sha256(body).hexdigest()[:32])
+    return state.ide_shell
+
+# -------------------- FRONT-END ASSETS --------------------
+# The pages use a hand-purged stylesheet (static/src/app.css) and vendored
+# copies of Monaco, Font Awesome and Inter instead of runtime CDN Tailwind and
+# third-party CDNs. `flask vendor-assets` downloads the pinned packages,
+# `flask build-assets` writes content-hashed copies of static/src plus a
+# manifest.json into ASSETS_PATH. Everything under /assets/ is named by
+# content hash or package version, so it is served as immutable.
+
+ASSETS_SOURCE = os.path.join(ROOT_PATH, 'static', 'src')
+ASSET_MANIFEST_NAME = 'manifest.json'
+
+# name -> (npm package, pinned version, path prefixes to keep, entry point,
+#          tarball integrity). The integrity is the registry's dist.integrity
+#          for that version (`npm view <package>@<version> dist.integrity`);
+#          vendor-assets refuses to unpack a package without one.
+VENDOR_PACKAGES = {
+    'monaco': ('monaco-editor', '0.44.0', ('min/vs/',), 'min/vs', None),
+    'fontawesome': ('@fortawesome/fontawesome-free', '6.0.0', ('css/all.min.css', 'webfonts/'), 'css/all.min.css',
+                    None),
+    'inter': ('@fontsource/inter', '5.0.16', ('files/inter-latin-',), 'files', None),  # @font-face in app.css
+}
+
+def vendor_dir(name):
+    package, version = VENDOR_PACKAGES[name][:2]
+    return f"vendor/{package.split('/')[-1]}-{version}"
+
+def asset_manifest():
+    state = runtime()
+    if state.asset_manifest is None:
+        try:
+            with open(os.path.join(current_app.config['ASSETS_PATH'], ASSET_MANIFEST_NAME)) as f:
+                state.asset_manifest = json.load(f)
+        except FileNotFoundError:
+            state.asset_manifest = {}
+    return state.asset_manifest
+
+@bp.app_template_global()
+def asset_url(name, path=''):
+    """URL of a front-end asset, from the build manifest when there is one.
+
+    Unbuilt checkouts fall back to static/src for our own files and to the
+    package's pinned version on jsDelivr for vendored ones.
+    """
+    entry = asset_manifest().get(name)
+    if entry is not None:
+        url = '/assets/' + entry
+    elif name in VENDOR_PACKAGES:
+        package, version, _, entry, _ = VENDOR_PACKAGES[name]
+        url = f"https://cdn.jsdelivr.net/npm/{package}@{version}/{entry}"
+    else:
+        url = f"{current_app.static_url_path}/src/{name}"
+    return f"{url}/{path}" if path else url
+
+def write_asset(path, data):
+    """Writes an asset and its precompressed variants next to it."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    for encoding, body in [(None, data)] + list(compress_variants(path, data).items()):
+        with open(path + ENCODING_SUFFIXES.get(encoding, ''), 'wb') as f:
+            f.write(body)
+
+def build_assets():
+    """Fingerprints static/src into ASSETS_PATH and rewrites the manifest.
+
+    Hashed files from earlier builds are left in place so pages rendered
+    before a deploy keep working; vendored packages are listed if present.
+    """
+    assets_path = current_app.config['ASSETS_PATH']
+    manifest = {}
+    for name in sorted(os.listdir(ASSETS_SOURCE)):
+        with open(os.path.join(ASSETS_SOURCE, name), 'rb') as f:
+            data = f.read()
+        stem, ext = os.path.splitext(name)
+        hashed = f"{stem}.{content_hash(data)[:12]}{ext}"
+        if not os.path.exists(os.path.join(assets_path, hashed)):
+            write_asset(os.path.join(assets_path, hashed), data)
+        manifest[name] = hashed
+    for name, (_, _, _, entry, _) in VENDOR_PACKAGES.items():
+        if os.path.isdir(os.path.join(assets_path, vendor_dir(name))):
+            manifest[name] = f"{vendor_dir(name)}/{entry}"
+
+    fd, tmp_path = tempfile.mkstemp(dir=assets_path)
+    with os.fdopen(fd, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, os.path.join(assets_path, ASSET_MANIFEST_NAME))
+
+    runtime().asset_manifest = manifest
+    runtime().ide_shell = None
+    return manifest
+
+class VendorError(Exception):
+    pass
+
+def tarball_integrity(f):
+    """The npm/SRI integrity string of file object `f`: 'sha512-<base64>'."""
+    digest = hashlib.sha512()
+    for chunk in iter(lambda: f.read(1024 * 1024), b''):
+        digest.update(chunk)
+    return 'sha512-' + base64.b64encode(digest.digest()).decode('ascii')
+
+def vendor_package(name):
+    """Downloads one pinned npm package, checks its integrity and unpacks the parts we serve."""
+    package, version, keep, _, integrity = VENDOR_PACKAGES[name]
+    if not integrity:
+        raise VendorError(f"{package}@{version}: no integrity pinned in VENDOR_PACKAGES")
+    target = os.path.join(current_app.config['ASSETS_PATH'], vendor_dir(name))
+    url = f"https://registry.npmjs.org/{package}/-/{package.split('/')[-1]}-{version}.tgz"
+    staging = tempfile.mkdtemp(dir=current_app.config['ASSETS_PATH'])
+    count = 0
+    try:
+        # The whole tarball is checked before a single file of it is unpacked
+        with urllib.request.urlopen(url, timeout=60) as response, tempfile.TemporaryFile() as download:
+            shutil.copyfileobj(response, download)
+            download.seek(0)
+            if not secrets.compare_digest(tarball_integrity(download), integrity):
+                raise VendorError(f"{package}@{version}: tarball does not match the pinned integrity")
+            download.seek(0)
+            with tarfile.open(fileobj=download, mode='r|gz') as archive:
+                for member in archive:
+                    # npm tarballs put everything under a single top-level "package/"
+                    relative = member.name.split('/', 1)[-1]
+                    if not member.isfile() or not relative.startswith(keep):
+                        continue
+                    path = safe_join(staging, relative)
+                    if path is None:
+                        continue
+                    write_asset(path, archive.extractfile(member).read())
+                    count += 1
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(staging, target)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    return count
+
+# -------------------- IDENTITY --------------------
+# The logged-in user is resolved once per request (current_user) from a
+# short-lived in-process cache, so the IDE page and its session fragment cost
+# no database round trips in the steady state. Entries are dropped explicitly
+# when this process changes them; the TTL bounds staleness across workers.
+
+UserRecord = namedtuple('UserRecord', 'id username')
+ProjectRecord = namedtuple('ProjectRecord', 'id name')
+
+class TTLCache:
+    """Small thread-safe dict whose entries expire after `ttl` seconds."""
+
+    def __init__(self, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            item = self.entries.get(key)
+            if item is None:
+                return None
+            if item[0] < time.monotonic():
+                del self.entries[key]
+                return None
+            return item[1]
+
+    def set(self, key, value):
+        with self.lock:
+            if len(self.entries) >= self.max_entries:
+                # Cheaper than LRU bookkeeping: drop the oldest insertions
+                for old_key in list(self.entries)[:self.max_entries // 10 + 1]:
+                    del self.entries[old_key]
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+user_cache = runtime_proxy('user_cache')
+project_list_cache = runtime_proxy('project_list_cache')
+
+def load_user(user_id):
+    record = user_cache.get(user_id)
+    if record is None:
+        user = db.session.get(User, user_id)
+        if user is None:
+            return None
+        record = UserRecord(user.id, user.username)
+        user_cache.set(user_id, record)
+    return record
+
+def current_user():
+    """The logged-in user of this request as a UserRecord, or None."""
+    if 'current_user' not in g:
+        user_id = session.get('user_id')
+        g.current_user = load_user(user_id) if user_id is not None else None
+    return g.current_user
+
+def forget_user(user_id):
+    user_cache.delete(user_id)
+    project_list_cache.delete(user_id)
+
+PROJECT_PAGE_SIZE = 50
+PROJECT_PAGE_MAX = 200
+
+def prefix_upper_bound(prefix):
+    """Smallest string above every string that starts with `prefix`, or None.
+
+    Increments the last character, skipping the surrogate range (not valid
+    in stored text) and carrying past U+10FFFF, which has no successor.
+    """
+    while prefix:
+        code = ord(prefix[-1])
+        if code < sys.maxunicode:
+            return prefix[:-1] + chr(0xE000 if code == 0xD7FF else code + 1)
+        prefix = prefix[:-1]
+    return None  # only U+10FFFF characters: no upper bound
+
+def project_page(user_id, after=None, prefix='', limit=PROJECT_PAGE_SIZE):
+    """One page of the user's projects in name order, as ProjectRecords.
+
+    Keyset pagination: the page starts strictly after the project named
+    `after`, so each page is a range scan on (user_id, name) no matter how
+    deep the client has scrolled. Returns (projects, next_cursor).
+    """
+    cacheable = after is None and not prefix and limit == PROJECT_PAGE_SIZE
+    if cacheable:
+        cached = project_list_cache.get(user_id)
+        if cached is not None:
+            return cached
+
+    query = Project.query.filter(Project.user_id == user_id)
+    if prefix:
+        # Half-open range instead of LIKE so SQLite can use the index
+        query = query.filter(Project.name >= prefix)
+        upper = prefix_upper_bound(prefix)
+        if upper is not None:
+            query = query.filter(Project.name < upper)
+    if after is not None:
+        query = query.filter(Project.name > after)
+    rows = query.order_by(Project.name).limit(limit + 1).with_entities(Project.id, Project.name).all()
+
+    projects = [ProjectRecord(row.id, row.name) for row in rows[:limit]]
+    next_cursor = projects[-1].name if len(rows) > limit else None
+    if cacheable:
+        project_list_cache.set(user_id, (projects, next_cursor))
+    return projects, next_cursor
+
+# -------------------- PASSWORDS --------------------
+# Passwords are stored as salted KDF hashes. Hashing is deliberately slow, so
+# it runs on a small per-worker pool with a fixed number of slots: a login
+# that finds them all taken is turned away with 503 straight away instead of
+# waiting on a thread that also serves deployed sites. Token buckets per IP and per username cap
+# how fast anyone can try passwords in the first place.
+
+class PasswordBusy(Exception):
+    pass
+
+password_executor = runtime_proxy('password_executor')
+password_slots = runtime_proxy('password_slots')
+
+def run_password_task(func, *args):
+    if not password_slots.acquire(blocking=False):
+        raise PasswordBusy()
+    try:
+        return password_executor.submit(func, *args).result()
+    finally:
+        password_slots.release()
+
+def hash_password(password):
+    return run_password_task(generate_password_hash, password, current_app.config['PASSWORD_HASH_METHOD'])
+
+def is_password_hash(stored):
+    return stored.count('$') >= 2 and stored.split(':', 1)[0] in ('scrypt', 'pbkdf2')
+
+def verify_password(stored, password):
+    """Checks a password against a stored hash (or a legacy plaintext value).
+
+    Returns (ok, needs_rehash). Unknown users are checked against a dummy
+    hash so that a miss costs as much as a wrong password.
+    """
+    if stored is None:
+        state = runtime()
+        if state.dummy_password_hash is None:
+            state.dummy_password_hash = hash_password(secrets.token_hex(16))
+        run_password_task(check_password_hash, state.dummy_password_hash, password)
+        return False, False
+    if not is_password_hash(stored):
+        # Rows from before hashing: compare once, then upgrade on success
+        return secrets.compare_digest(stored.encode('utf-8'), password.encode('utf-8')), True
+    ok = run_password_task(check_password_hash, stored, password)
+    return ok, ok and stored.split('$', 1)[0] != current_app.config['PASSWORD_HASH_METHOD']
+
+class TokenBucketLimiter:
+    """Per-key token buckets: `burst` attempts at once, refilled at `rate` per second."""
+
+    def __init__(self, burst, rate, max_keys=100000):
+        self.burst = burst
+        self.rate = rate
+        self.max_keys = max_keys
+        self.buckets = {}  # key -> (tokens, last update)
+        self.lock = threading.Lock()
+
+    def allow(self, key):
+        """Takes a token for `key`; returns seconds to wait if there is none, else 0."""
+        now = time.monotonic()
+        with self.lock:
+            tokens, updated = self.buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if len(self.buckets) >= self.max_keys:
+                # Same trade-off as TTLCache: drop the least recently touched keys
+                for old_key in list(self.buckets)[:self.max_keys // 10 + 1]:
+                    del self.buckets[old_key]
+            if tokens < 1:
+                self.buckets[key] = (tokens, now)
+                return (1 - tokens) / self.rate
+            self.buckets[key] = (tokens - 1, now)
+            return 0
+
+login_ip_limiter = runtime_proxy('login_ip_limiter')
+login_username_limiter = runtime_proxy('login_username_limiter')
+signup_ip_limiter = runtime_proxy('signup_ip_limiter')
+
+def auth_refusal(template_args, message, status, retry_after=None):
+    flash(message)
+    response = make_response(render_template('auth.html', **template_args), status)
+    if retry_after:
+        response.headers['Retry-After'] = str(int(retry_after) + 1)
+    return response
+
+# -------------------- STORAGE --------------------
+# Deployed projects live behind a storage backend. Every deployment has a
+# manifest mapping file names to a content hash, size and the precompressed
+# variants produced at deploy time:
+#   {'index.html': {'etag': ..., 'size': ..., 'encodings': ['gzip']}}
+
+MANIFEST_NAME = '.manifest.json'
+COMPRESSIBLE_TYPES = ('.html', '.css', '.js', '.json', '.svg', '.txt')
+ENCODING_SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+
+def compress_variants(filename, data):
+    """Returns {encoding: bytes} for the variants worth storing."""
+    variants = {}
+    if not filename.endswith(COMPRESSIBLE_TYPES):
+        return variants
+    gz = gzip.compress(data, compresslevel=9, mtime=0)
+    if len(gz) < len(data):
+        variants['gzip'] = gz
+    if brotli is not None:
+        br = brotli.compress(data)
+        if len(br) < len(data):
+            variants['br'] = br
+    return variants
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+# Storage backends accept file bodies either as bytes or, for large uploads,
+# as the path of a staged file on disk that is only ever read in chunks.
+CHUNK_SIZE = 64 * 1024
+
+def body_chunks(body):
+    if isinstance(body, bytes):
+        yield body
+        return
+    with open(body, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            yield chunk
+
+def body_size(body):
+    return len(body) if isinstance(body, bytes) else os.path.getsize(body)
+
+def body_hash(body):
+    digest = hashlib.sha256()
+    for chunk in body_chunks(body):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+def write_body(path, body):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        for chunk in body_chunks(body):
+            f.write(chunk)
+    storage_bytes_written.inc(body_size(body), backend='directory')
+
+def body_variants(filename, body):
+    """compress_variants() for a body; staged files are compressed to files next to them."""
+    if isinstance(body, bytes):
+        return compress_variants(filename, body)
+    variants = {}
+    if not filename.endswith(COMPRESSIBLE_TYPES):
+        return variants
+    size = os.path.getsize(body)
+    with open(body + '.gz', 'wb') as raw, gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=9, mtime=0) as gz:
+        for chunk in body_chunks(body):
+            gz.write(chunk)
+    if os.path.getsize(body + '.gz') < size:
+        variants['gzip'] = body + '.gz'
+    if brotli is not None:
+        compressor = brotli.Compressor()
+        with open(body + '.br', 'wb') as f:
+            for chunk in body_chunks(body):
+                f.write(compressor.process(chunk))
+            f.write(compressor.finish())
+        if os.path.getsize(body + '.br') < size:
+            variants['br'] = body + '.br'
+    return variants
+
+def new_version_id(timestamp=None):
+    """Sortable, unique deploy version id, e.g. 20240101120000123456-1a2b3c."""
+    timestamp = time.time() if timestamp is None else timestamp
+    stamp = time.strftime('%Y%m%d%H%M%S', time.gmtime(timestamp)) + '%06d' % (timestamp % 1 * 1e6)
+    return f"{stamp}-{secrets.token_hex(3)}"
+
+class DirectoryStorage:
+    """Plain layout: projects/<username>/<project_name>/<file> (+ .gz/.br).
+
+    Every deploy is written once into <username>/.versions/<project_name>/<version>/
+    and <username>/<project_name> is a symlink to the active version, swapped
+    with a single atomic os.replace(). Projects deployed before versioning are
+    plain directories until their next deploy.
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def project_path(self, username, project_name):
+        return safe_join(self.root, username, project_name)
+
+    def versions_path(self, username, project_name):
+        return safe_join(self.root, username, '.versions', project_name)
+
+    def version_path(self, username, project_name, version=None):
+        """Directory of a version's files; the project path if version is None."""
+        if version is None:
+            return self.project_path(username, project_name)
+        versions_path = self.versions_path(username, project_name)
+        return versions_path and safe_join(versions_path, version)
+
+    def current_version(self, username, project_name):
+        try:
+            return os.path.basename(os.readlink(self.project_path(username, project_name)))
+        except (OSError, TypeError):
+            return None  # not deployed, or a plain pre-versioning directory
+
+    def write_project(self, username, project_name, files, sources=None, partial=False, variants=None):
+        """Writes files ({name: body}) as a new version and activates it.
+
+        Names may contain '/' for nested paths. sources records, per file, the hash of the editor content it was built
+        from. With partial=True files not passed in are carried over from the
+        active version by hard link instead of being rewritten. variants
+        ({name: {encoding: bytes}}) are computed here unless given.
+        """
+        previous = self.current_version(username, project_name)
+        previous_path = self.version_path(username, project_name, previous)
+        manifest = (self.read_manifest(username, project_name, previous) or {}) if partial else {}
+        version = new_version_id()
+        path = self.version_path(username, project_name, version)
+        os.makedirs(path)
+
+        for name, entry in manifest.items():
+            if name in files:
+                continue
+            for suffix in [''] + [ENCODING_SUFFIXES[e] for e in entry['encodings']]:
+                source, target = os.path.join(previous_path, name + suffix), os.path.join(path, name + suffix)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                try:
+                    os.link(source, target)
+                except OSError:
+                    shutil.copyfile(source, target)
+
+        for name, data in files.items():
+            file_variants = body_variants(name, data) if variants is None else variants.get(name, {})
+            write_body(os.path.join(path, name), data)
+            for encoding, body in file_variants.items():
+                write_body(os.path.join(path, name + ENCODING_SUFFIXES[encoding]), body)
+            manifest[name] = {
+                'etag': body_hash(data)[:32],
+                'size': body_size(data),
+                'encodings': sorted(file_variants),
+            }
+            if sources and name in sources:
+                manifest[name]['source'] = sources[name]
+        with open(os.path.join(path, MANIFEST_NAME), 'w') as f: json.dump(manifest, f)
+
+        self.activate(username, project_name, version)
+        return manifest
+
+    def activate(self, username, project_name, version):
+        """Points the project at an existing version with one atomic rename."""
+        # Only a directory directly under .versions/<project>; never None,
+        # which version_path() maps to the project link itself
+        versions_path = self.versions_path(username, project_name)
+        if not isinstance(version, str) or not version or version.startswith('.') or not versions_path:
+            raise KeyError(version)
+        target = safe_join(versions_path, version)
+        if not target or os.path.dirname(target) != versions_path or not os.path.isdir(target):
+            raise KeyError(version)
+        path = self.project_path(username, project_name)
+        if os.path.isdir(path) and not os.path.islink(path):
+            # First deploy since versioning: the old files become a version
+            os.rename(path, self.version_path(username, project_name, new_version_id(os.path.getmtime(path))))
+        tmp_link = os.path.join(os.path.dirname(path), f".{project_name}.{secrets.token_hex(4)}.tmp")
+        os.symlink(os.path.relpath(target, os.path.dirname(path)), tmp_link)
+        os.replace(tmp_link, path)
+
+    def list_versions(self, username, project_name):
+        """Versions newest first: [{'version', 'created', 'active'}]."""
+        versions_path = self.versions_path(username, project_name)
+        if not versions_path or not os.path.isdir(versions_path):
+            return []
+        active = self.current_version(username, project_name)
+        return [{'version': version,
+                 'created': int(os.path.getmtime(os.path.join(versions_path, version))),
+                 'active': version == active}
+                for version in sorted(os.listdir(versions_path), reverse=True)]
+
+    def collect_garbage(self, username, project_name, keep):
+        """Deletes all but the newest `keep` versions (never the active one)."""
+        removed = 0
+        for info in self.list_versions(username, project_name)[keep:]:
+            if not info['active']:
+                shutil.rmtree(self.version_path(username, project_name, info['version']), ignore_errors=True)
+                removed += 1
+        return removed
+
+    def compact(self):
+        return 0  # versions are plain directories, nothing to repack
+
+    def read_manifest(self, username, project_name, version=None):
+        path = self.version_path(username, project_name, version)
+        if not path:
+            return None
+        try:
+            with open(os.path.join(path, MANIFEST_NAME)) as f:
+                return json.load(f)
+        except ValueError:
+            return None
+        except OSError:
+            return self._legacy_manifest(path)
+
+    def _legacy_manifest(self, path):
+        # Deployed before manifests existed: hash on the fly, no variants
+        if not os.path.isdir(path):
+            return None
+        manifest = {}
+        for name in os.listdir(path):
+            file_path = os.path.join(path, name)
+            if name.startswith('.') or not os.path.isfile(file_path):
+                continue
+            with open(file_path, 'rb') as f: data = f.read()
+            manifest[name] = {'etag': content_hash(data)[:32], 'size': len(data), 'encodings': []}
+        return manifest
+
+    def read_file(self, username, project_name, filename, encoding=None, version=None):
+        path = self.version_path(username, project_name, version)
+        file_path = path and safe_join(path, filename + (ENCODING_SUFFIXES[encoding] if encoding else ''))
+        try:
+            with open(file_path, 'rb') as f:
+                return f.read()
+        except (OSError, TypeError):
+            return None
+
+    def version_token(self, username, project_name):
+        """Cheap value that changes whenever the project is redeployed."""
+        version = self.current_version(username, project_name)
+        if version is not None:
+            return version
+        path = self.project_path(username, project_name)
+        try:
+            return os.stat(os.path.join(path, MANIFEST_NAME)).st_mtime_ns
+        except (OSError, TypeError):
+            return None
+
+    def iter_projects(self):
+        if not os.path.isdir(self.root):
+            return
+        for username in sorted(os.listdir(self.root)):
+            user_path = os.path.join(self.root, username)
+            if os.path.isdir(user_path):
+                for project_name in sorted(os.listdir(user_path)):
+                    if not project_name.startswith('.') and os.path.isdir(os.path.join(user_path, project_name)):
+                        yield username, project_name
+
+class ContentAddressedStorage:
+    """Deduplicated blob store packed into append-only segment files.
+
+    Layout under root:
+      segments/NNNNNN.seg  concatenated blob bytes, read through mmap
+      blobs.idx            fixed-size records: sha256, segment, offset, length
+      refs.log             JSON lines: new versions, activations and prunes
+      lock                 flock()ed by writers, so several workers can deploy
+
+    Manifests are stored as blobs too; their entries carry the blob hash of
+    each variant under 'blobs'. A version is just a manifest hash, so
+    activating or rolling back is one appended line. Readers pick up other
+    processes' writes by reading the tail of blobs.idx and refs.log when
+    those files grow, and read them again from the start when compact() has
+    replaced them with rewritten copies.
+    """
+
+    INDEX_RECORD = struct.Struct('>32sIQQ')
+    TOMBSTONE = 0xFFFFFFFF  # segment number of an index record deleting a blob
+    COMPACT_AFTER_PRUNES = 50
+
+    def __init__(self, root, segment_size=64 * 1024 * 1024):
+        self.root = root
+        self.segment_size = segment_size
+        self.segments_path = os.path.join(root, 'segments')
+        self.index_path = os.path.join(root, 'blobs.idx')
+        self.refs_path = os.path.join(root, 'refs.log')
+        os.makedirs(self.segments_path, exist_ok=True)
+        for path in (self.index_path, self.refs_path):
+            open(path, 'ab').close()
+        self.blobs = {}  # sha256 digest -> (segment, offset, length)
+        self.versions = {}  # (username, project_name) -> {version: {'manifest', 'created'}}, oldest first
+        self.active = {}  # (username, project_name) -> version
+        self.index_offset = self.refs_offset = 0
+        self.index_inode = self.refs_inode = None
+        self.pruned_since_compact = 0
+        self.maps = {}  # segment -> mmap
+        self.lock = threading.RLock()
+        self.refresh()
+
+    # --- reading ---
+    def refresh(self):
+        """Loads index records and refs appended since the last call."""
+        with self.lock:
+            data, replaced = self._read_tail(self.index_path, 'index')
+            if data is not None:
+                blobs = {} if replaced else self.blobs
+                usable = len(data) - len(data) % self.INDEX_RECORD.size
+                for digest, segment, offset, length in self.INDEX_RECORD.iter_unpack(data[:usable]):
+                    if segment == self.TOMBSTONE:
+                        blobs.pop(digest, None)
+                    else:
+                        blobs[digest] = (segment, offset, length)
+                self.blobs = blobs
+                self.index_offset += usable
+            data, replaced = self._read_tail(self.refs_path, 'refs')
+            if data is not None:
+                versions, active = ({}, {}) if replaced else (self.versions, self.active)
+                usable = data.rfind(b'\n') + 1  # ignore a torn last line
+                for line in data[:usable].splitlines():
+                    self._apply_ref(json.loads(line), versions, active)
+                self.versions, self.active = versions, active
+                self.refs_offset += usable
+
+    def _read_tail(self, path, name):
+        """Returns (bytes past the <name>_offset, whether the file was replaced), or (None, False).
+
+        A file with a new inode was rewritten by compact(): the offset is
+        reset and the whole file returned.
+        """
+        stat = os.stat(path)
+        if stat.st_ino == getattr(self, name + '_inode') and stat.st_size <= getattr(self, name + '_offset'):
+            return None, False
+        with open(path, 'rb') as f:
+            inode = os.fstat(f.fileno()).st_ino  # may be newer than the stat above
+            replaced = inode != getattr(self, name + '_inode')
+            if replaced:
+                setattr(self, name + '_inode', inode)
+                setattr(self, name + '_offset', 0)
+            f.seek(getattr(self, name + '_offset'))
+            return f.read(), replaced
+
+    @staticmethod
+    def _apply_ref(ref, versions, active):
+        key = (ref['username'], ref['project'])
+        if 'manifest' in ref:
+            version = ref.get('version') or ref['manifest'][:16]
+            versions.setdefault(key, {})[version] = {'manifest': ref['manifest'], 'created': ref.get('created', 0)}
+            active[key] = version
+        elif 'activate' in ref:
+            active[key] = ref['activate']
+        elif 'prune' in ref:
+            for version in ref['prune']:
+                versions.get(key, {}).pop(version, None)
+
+    def read_blob(self, blob_hash, retry=True):
+        location = self.blobs.get(bytes.fromhex(blob_hash))
+        if location is None:
+            return None
+        segment, offset, length = location
+        if length == 0:
+            return b''
+        with self.lock:
+            segment_map = self.maps.get(segment)
+            if segment_map is None or len(segment_map) < offset + length:
+                try:
+                    with open(self._segment_file(segment), 'rb') as f:
+                        segment_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                except FileNotFoundError:
+                    if not retry:
+                        raise
+                    # Compacted away by another process: reload the index
+                    self.refresh()
+                    return self.read_blob(blob_hash, retry=False)
+                old_map = self.maps.pop(segment, None)
+                self.maps[segment] = segment_map
+                if old_map is not None:
+                    old_map.close()
+            return segment_map[offset:offset + length]
+
+    def current_version(self, username, project_name):
+        self.refresh()
+        return self.active.get((username, project_name))
+
+    def read_manifest(self, username, project_name, version=None):
+        key = (username, project_name)
+        version = version or self.current_version(username, project_name)
+        info = self.versions.get(key, {}).get(version)
+        if info is None:
+            return None
+        return json.loads(self.read_blob(info['manifest']))
+
+    def read_file(self, username, project_name, filename, encoding=None, version=None):
+        manifest = self.read_manifest(username, project_name, version)
+        entry = manifest and manifest.get(filename)
+        if entry is None or (encoding or '') not in entry['blobs']:
+            return None
+        return self.read_blob(entry['blobs'][encoding or ''])
+
+    def version_token(self, username, project_name):
+        return self.current_version(username, project_name)
+
+    def list_versions(self, username, project_name):
+        self.refresh()
+        key = (username, project_name)
+        active = self.active.get(key)
+        return [{'version': version, 'created': info['created'], 'active': version == active}
+                for version, info in reversed(list(self.versions.get(key, {}).items()))]
+
+    def iter_projects(self):
+        self.refresh()
+        return iter(sorted(self.active))
+
+    # --- writing ---
+    def write_project(self, username, project_name, files, sources=None, partial=False, variants=None):
+        blobs = []
+        manifest = dict(self.read_manifest(username, project_name) or {}) if partial else {}
+        for name, data in files.items():
+            bodies = dict(body_variants(name, data) if variants is None else variants.get(name, {}))
+            bodies[''] = data
+            entry_blobs = {}
+            for encoding, body in bodies.items():
+                entry_blobs[encoding] = body_hash(body)
+                blobs.append((entry_blobs[encoding], body))
+            manifest[name] = {
+                'etag': entry_blobs[''][:32],
+                'size': body_size(data),
+                'encodings': sorted(e for e in bodies if e),
+                'blobs': entry_blobs,
+            }
+            if sources and name in sources:
+                manifest[name]['source'] = sources[name]
+        manifest_data = json.dumps(manifest, sort_keys=True).encode('utf-8')
+        blobs.append((content_hash(manifest_data), manifest_data))
+        with self._write_lock():
+            self._append_blobs(blobs)
+            self._append_ref({'username': username, 'project': project_name,
+                              'manifest': content_hash(manifest_data),
+                              'version': new_version_id(), 'created': int(time.time())})
+        return manifest
+
+    def activate(self, username, project_name, version):
+        with self._write_lock():
+            if version not in self.versions.get((username, project_name), {}):
+                raise KeyError(version)
+            self._append_ref({'username': username, 'project': project_name, 'activate': version})
+
+    def collect_garbage(self, username, project_name, keep):
+        """Forgets all but the newest `keep` versions (never the active one).
+
+        The blobs they used are reclaimed by compact(), which runs once
+        enough versions have been pruned.
+        """
+        with self._write_lock():
+            pruned = [info['version'] for info in self.list_versions(username, project_name)[keep:]
+                      if not info['active']]
+            if pruned:
+                self._append_ref({'username': username, 'project': project_name, 'prune': pruned})
+                self.pruned_since_compact += len(pruned)
+        if self.pruned_since_compact >= self.COMPACT_AFTER_PRUNES:
+            self.compact()
+        return len(pruned)
+
+    def compact(self, min_dead_ratio=0.5):
+        """Copies live blobs out of mostly-dead segments and deletes those segments.
+
+        blobs.idx and refs.log are then rewritten with only what is still in
+        use. Returns the number of bytes freed.
+        """
+        with self._write_lock():
+            live = set()
+            for versions in self.versions.values():
+                for info in versions.values():
+                    live.add(bytes.fromhex(info['manifest']))
+                    for entry in json.loads(self.read_blob(info['manifest'])).values():
+                        live.update(bytes.fromhex(blob_hash) for blob_hash in entry['blobs'].values())
+            logs_size = self._logs_size()
+            freed = self._compact_segments(live, min_dead_ratio)
+            self._rewrite_logs(live)
+            self.pruned_since_compact = 0
+            return freed + logs_size - self._logs_size()
+
+    def _compact_segments(self, live, min_dead_ratio):
+        # Sizes come from the files: dead blobs are dropped from the index
+        # by _rewrite_logs() but stay in their segment until it is compacted
+        total = {int(name[:-4]): os.path.getsize(os.path.join(self.segments_path, name))
+                 for name in os.listdir(self.segments_path) if name.endswith('.seg')}
+        used = {}
+        for digest, (segment, offset, length) in self.blobs.items():
+            if digest in live:
+                used[segment] = used.get(segment, 0) + length
+        current = max(total, default=0)
+        victims = {segment for segment in total
+                   if segment != current and used.get(segment, 0) <= total[segment] * (1 - min_dead_ratio)}
+        if not victims:
+            return 0
+
+        moved, dead = [], []
+        for digest, (segment, offset, length) in list(self.blobs.items()):
+            if segment in victims:
+                if digest in live:
+                    moved.append((digest.hex(), self.read_blob(digest.hex())))
+                    del self.blobs[digest]
+                else:
+                    dead.append(digest)
+        # New locations are appended before anything is deleted, so other
+        # processes can always find a live blob after a refresh()
+        self._append_blobs(moved)
+        self._append(self.index_path, b''.join(self.INDEX_RECORD.pack(digest, self.TOMBSTONE, 0, 0)
+                                               for digest in dead))
+        self.refresh()
+        for segment in victims:
+            segment_map = self.maps.pop(segment, None)
+            if segment_map is not None:
+                segment_map.close()
+            os.remove(self._segment_file(segment))
+        return sum(total[segment] for segment in victims) - sum(len(body) for _, body in moved)
+
+    def _rewrite_logs(self, live):
+        """Replaces blobs.idx and refs.log with one record per `live` blob and
+        one line per kept version (plus the activation, if not the newest).
+
+        Must hold the write lock. Other processes notice the new inodes on
+        their next refresh().
+        """
+        self._replace(self.index_path, b''.join(self.INDEX_RECORD.pack(digest, *location)
+                                                for digest, location in self.blobs.items() if digest in live))
+        lines = []
+        for key in sorted(self.versions.keys() | self.active.keys()):
+            ref = {'username': key[0], 'project': key[1]}
+            versions = self.versions.get(key, {})
+            for version, info in versions.items():
+                lines.append(dict(ref, manifest=info['manifest'], version=version, created=info['created']))
+            if key in self.active and self.active[key] != next(reversed(versions), None):
+                lines.append(dict(ref, activate=self.active[key]))
+        self._replace(self.refs_path, b''.join(json.dumps(line).encode('utf-8') + b'\n' for line in lines))
+        self.refresh()
+
+    def _logs_size(self):
+        return os.path.getsize(self.index_path) + os.path.getsize(self.refs_path)
+
+    def _replace(self, path, data):
+        tmp_path = path + '.tmp'
+        f = open(tmp_path, 'wb')
+        f.write(data)
+        self._sync_close(f)
+        os.replace(tmp_path, path)
+
+    @contextlib.contextmanager
+    def _write_lock(self):
+        with self.lock, open(os.path.join(self.root, 'lock'), 'wb') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                self.refresh()
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _append_ref(self, ref):
+        self._append(self.refs_path, json.dumps(ref).encode('utf-8') + b'\n')
+        self.refresh()
+
+    def _append_blobs(self, blobs):
+        """Appends (hex hash, body) pairs that are not stored yet."""
+        records = []
+        new = {}
+        for blob_hash, body in blobs:
+            digest = bytes.fromhex(blob_hash)
+            if digest not in self.blobs and digest not in new:
+                new[digest] = body
+        if not new:
+            return
+        segment = self._current_segment()
+        f = open(self._segment_file(segment), 'ab')
+        try:
+            offset = f.tell()
+            for digest, body in new.items():
+                size = body_size(body)
+                if offset and offset + size > self.segment_size:
+                    self._sync_close(f)
+                    segment += 1
+                    f = open(self._segment_file(segment), 'ab')
+                    offset = 0
+                for chunk in body_chunks(body):
+                    f.write(chunk)
+                records.append(self.INDEX_RECORD.pack(digest, segment, offset, size))
+                offset += size
+                storage_bytes_written.inc(size, backend='cas')
+        finally:
+            self._sync_close(f)
+        # Index after data, refs after index: a reader never sees a dangling hash
+        self._append(self.index_path, b''.join(records))
+
+    def _append(self, path, data):
+        f = open(path, 'ab')
+        f.write(data)
+        self._sync_close(f)
+
+    def _sync_close(self, f):
+        f.flush()
+        os.fsync(f.fileno())
+        f.close()
+
+    def _segment_file(self, segment):
+        return os.path.join(self.segments_path, '%06d.seg' % segment)
+
+    def _current_segment(self):
+        segments = [int(name[:-4]) for name in os.listdir(self.segments_path) if name.endswith('.seg')]
+        return max(segments, default=0)
+
+def create_storage(backend, path):
+    if backend == 'directory':
+        return DirectoryStorage(path)
+    if backend == 'cas':
+        return ContentAddressedStorage(path)
+    raise ValueError(f"Unknown storage backend: {backend}")
+
+class LazyStorage:
+    """Opens the storage backend on first use rather than at startup.
+
+    Opening the content-addressed store reads its index and maps segments,
+    which belongs in the worker process, not in a preloading parent.
+    """
+
+    def __init__(self, backend, path):
+        self._args = (backend, path)
+        self._backend = None
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        if self._backend is None:
+            with self._lock:
+                if self._backend is None:
+                    self._backend = create_storage(*self._args)
+        return getattr(self._backend, name)
+
+storage = runtime_proxy('storage')  # a LazyStorage
+
+# Old versions are pruned off the request path, one project at a time
+gc_executor = runtime_proxy('gc_executor')
+
+def collect_project_garbage(app, username, project_name):
+    try:
+        with app.app_context():
+            storage.collect_garbage(username, project_name, app.config['DEPLOY_KEEP_VERSIONS'])
+    except Exception:
+        app.logger.exception("Garbage collection failed for %s/%s", username, project_name)
+
+def schedule_garbage_collection(username, project_name):
+    gc_executor.submit(collect_project_garbage, current_app._get_current_object(), username, project_name)
+
+# -------------------- DEPLOYED FILES --------------------
+
+def choose_encoding(available):
+    """Picks the best precompressed variant the client accepts, or None."""
+    for encoding in ('br', 'gzip'):
+        if encoding in available and request.accept_encodings[encoding]:
+            return encoding
+    return None
+
+def cache_control_for(filename):
+    policies = current_app.config['DEPLOY_CACHE_CONTROL']
+    return policies.get(os.path.splitext(filename)[1].lower(), policies[''])
+
+class CachedFile:
+    """A deployed file with all its variants and ready-made response headers."""
+
+    def __init__(self, key, version, mimetype, etag, cache_control, bodies):
+        self.key = key
+        self.version = version
+        self.etag = etag
+        self.checked_at = time.monotonic()
+        self.mimetype = mimetype
+        self.bodies = bodies  # {encoding or None: bytes}
+        self.encodings = [e for e in bodies if e]
+        self.size = sum(len(b) for b in bodies.values())
+        self.headers = {}
+        for encoding in bodies:
+            headers = {
+                'ETag': '"%s%s"' % (etag, '-' + encoding if encoding else ''),
+                'Cache-Control': cache_control,
+            }
+            if encoding:
+                headers['Content-Encoding'] = encoding
+            if self.encodings:
+                headers['Vary'] = 'Accept-Encoding'
+            self.headers[encoding] = headers
+
+class SiteCache:
+    """LRU cache of deployed files, bounded by entry count and total bytes."""
+
+    def __init__(self, max_entries, max_bytes, revalidate_seconds):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.revalidate_seconds = revalidate_seconds
+        self.entries = OrderedDict()
+        self.by_project = {}
+        self.total_bytes = 0
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+        if time.monotonic() - entry.checked_at > self.revalidate_seconds:
+            # Cheap cross-process check that the project was not redeployed
+            if storage.version_token(*key[:2]) != entry.version:
+                self.invalidate(*key[:2])
+                with self.lock:
+                    self.misses += 1
+                return None
+            entry.checked_at = time.monotonic()
+        with self.lock:
+            self.hits += 1
+        return entry
+
+    def put(self, entry):
+        # A single file may not take more than an eighth of the cache
+        if entry.size > self.max_bytes // 8:
+            return
+        with self.lock:
+            self._remove(entry.key)
+            self.entries[entry.key] = entry
+            self.by_project.setdefault(entry.key[:2], set()).add(entry.key)
+            self.total_bytes += entry.size
+            while len(self.entries) > self.max_entries or self.total_bytes > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def invalidate(self, username, project_name):
+        with self.lock:
+            for key in list(self.by_project.get((username, project_name), ())):
+                self._remove(key)
+            self.invalidations += 1
+
+    def _remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        self.total_bytes -= entry.size
+        keys = self.by_project.get(key[:2])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self.by_project[key[:2]]
+
+    def stats(self):
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'bytes': self.total_bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
+
+site_cache = runtime_proxy('site_cache')
+
+def load_deployed_file(username, project_name, filename):
+    """Reads a deployed file and its variants from storage into a CachedFile."""
+    token = storage.version_token(username, project_name)
+    # Pin the active version so the manifest and the bytes always match
+    version = storage.current_version(username, project_name)
+    entry = (storage.read_manifest(username, project_name, version) or {}).get(filename)
+    if entry is None:
+        return None
+    bodies = {}
+    for encoding in [None] + entry['encodings']:
+        bodies[encoding] = storage.read_file(username, project_name, filename, encoding, version)
+        if bodies[encoding] is None:
+            return None
+    return CachedFile((username, project_name, filename), token,
+                      mimetypes.guess_type(filename)[0] or 'application/octet-stream',
+                      entry['etag'], cache_control_for(filename), bodies)
+
+def serve_deployed_file(username, project_name, filename):
+    key = (username, project_name, filename)
+    cached = site_cache.get(key)
+    if cached is None:
+        cached = load_deployed_file(username, project_name, filename)
+        if cached is None:
+            return None
+        site_cache.put(cached)
+
+    encoding = choose_encoding(cached.encodings)
+    headers = cached.headers[encoding]
+    asset_version = request.args.get('v')
+    if asset_version and len(asset_version) == ASSET_VERSION_LENGTH and cached.etag[:ASSET_VERSION_LENGTH] == asset_version:
+        # Fingerprinted URL (see the hash_assets deploy stage): never changes
+        headers = dict(headers, **{'Cache-Control': current_app.config['DEPLOY_IMMUTABLE_CACHE_CONTROL']})
+    response = current_app.response_class(cached.bodies[encoding], mimetype=cached.mimetype, headers=headers)
+    return response.make_conditional(request, accept_ranges=False)
+
+# -------------------- DEPLOY PIPELINE --------------------
+# deploy_api only validates the request and queues a DeployJob; a small local
+# worker pool builds the files through the stages named in DEPLOY_PIPELINE
+# and writes what changed. Register extra stages with @deploy_stage('name').
+
+# Editor form fields and the deployed file each one produces
+DEPLOY_FIELDS = {'html_code': 'index.html', 'css_code': 'style.css', 'js_code': 'script.js'}
+
+def source_matches(entry, source_hash):
+    """True if a manifest entry was built from editor content with this sha256."""
+    if entry is None or not source_hash:
+        return False
+    if 'source' in entry:
+        return entry['source'] == source_hash
+    # Deployed before sources were recorded: CSS/JS files are the field verbatim
+    return entry['etag'] == source_hash[:32]
+
+def render_index_html(username, project_name, html_code):
+    return f"""<!DOCTYPE html>
+<html>
+<head>
+<title>{project_name}</title>
+<meta name="viewport" content="width=device-width, initial-scale=1.0">
+<link rel="stylesheet" href="/{username}/{project_name}/style.css">
+</head>
+<body>
+{html_code}
+<script src="/{username}/{project_name}/script.js"></script>
+</body>
+</html>"""
+
+class DeployBuild:
+    """What the pipeline stages work on for one deploy."""
+
+    def __init__(self, username, project_name, files, sources, manifest):
+        self.username = username
+        self.project_name = project_name
+        self.files = files  # {name: bytes} being deployed
+        self.sources = sources  # {name: sha256 of the editor field}
+        self.manifest = manifest  # currently deployed version
+        self.variants = {}  # {name: {encoding: bytes}}, filled by 'compress'
+
+DEPLOY_STAGES = {}
+
+def deploy_stage(name):
+    def register(func):
+        DEPLOY_STAGES[name] = func
+        return func
+    return register
+
+HTML_COMMENT = re.compile(r'<!--(?!\[if).*?-->', re.S)
+HTML_RAW_BLOCK = re.compile(r'(<(pre|textarea|code|script|style)\b.*?</\2\s*>)', re.S | re.I)
+# Strings and comments; split() on this leaves only real CSS code in between
+CSS_LITERAL = re.compile(r'''("(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*'|/\*.*?\*/)''', re.S)
+CSS_SPACE = re.compile(r'\s*([{};,])\s*')
+
+@deploy_stage('minify_html')
+def minify_html(build):
+    """Drops comments and blank runs; leaves pre/textarea/code/script/style alone.
+
+    Not in the default pipeline: it cannot see CSS that makes other
+    elements whitespace-sensitive.
+    """
+    if 'index.html' not in build.files:
+        return
+    parts = HTML_RAW_BLOCK.split(build.files['index.html'].decode('utf-8'))
+    out = []
+    # split() yields text, block, tag name, text, block, tag name, ...
+    for i in range(0, len(parts), 3):
+        text = HTML_COMMENT.sub('', parts[i])
+        out.append(re.sub(r'\s*\n\s*', '\n', re.sub(r'[ \t]+', ' ', text)))
+        if i + 1 < len(parts):
+            out.append(parts[i + 1])
+    build.files['index.html'] = ''.join(out).strip().encode('utf-8')
+
+@deploy_stage('minify_css')
+def minify_css(build):
+    if 'style.css' not in build.files:
+        return
+    pieces, code = [], []
+    # split() yields code, literal, code, literal, ...; strings are kept
+    # exactly as written, comments dropped, and only code is squeezed
+    for i, part in enumerate(CSS_LITERAL.split(build.files['style.css'].decode('utf-8'))):
+        if i % 2 == 0:
+            code.append(part)
+        elif not part.startswith('/*'):
+            pieces.extend([squeeze_css(''.join(code)), part])
+            code = []
+    pieces.append(squeeze_css(''.join(code)))
+    build.files['style.css'] = ''.join(pieces).strip().encode('utf-8')
+
+def squeeze_css(code):
+    return CSS_SPACE.sub(r'\1', re.sub(r'\s+', ' ', code)).replace(';}', '}')
+
+@deploy_stage('minify_js')
+def minify_js(build):
+    # Safe JS minification needs a real tokenizer; only used when rjsmin is installed
+    if 'script.js' not in build.files or rjsmin is None:
+        return
+    build.files['script.js'] = rjsmin.jsmin(build.files['script.js'].decode('utf-8')).encode('utf-8')
+
+ASSET_VERSION_LENGTH = 12  # hex digits of the content hash in ?v=
+
+@deploy_stage('hash_assets')
+def hash_assets(build):
+    """Links style.css/script.js as ?v=<content hash> so they can be cached forever."""
+    changed = [name for name in ('style.css', 'script.js') if name in build.files]
+    if 'index.html' not in build.files:
+        if not changed or 'index.html' not in build.manifest:
+            return
+        # The page itself is unchanged but must point at the new assets
+        current = storage.read_file(build.username, build.project_name, 'index.html')
+        if current is None:
+            return
+        build.files['index.html'] = current
+        if 'source' in build.manifest['index.html']:
+            build.sources['index.html'] = build.manifest['index.html']['source']
+
+    versions = {}
+    for name in ('style.css', 'script.js'):
+        if name in build.files:
+            versions[name] = content_hash(build.files[name])[:ASSET_VERSION_LENGTH]
+        elif name in build.manifest:
+            versions[name] = build.manifest[name]['etag'][:ASSET_VERSION_LENGTH]
+    prefix = f"/{build.username}/{build.project_name}/".encode('utf-8')
+    pattern = re.compile(re.escape(prefix) + rb'(style\.css|script\.js)(?:\?v=[0-9a-f]*)?(?=")')
+
+    def link(match):
+        name = match.group(1).decode('utf-8')
+        if name not in versions:
+            return match.group(0)
+        return prefix + match.group(1) + b'?v=' + versions[name].encode('utf-8')
+
+    build.files['index.html'] = pattern.sub(link, build.files['index.html'])
+
+@deploy_stage('compress')
+def compress(build):
+    for name, data in build.files.items():
+        build.variants[name] = compress_variants(name, data)
+
+deploy_executor = runtime_proxy('deploy_executor')
+
+def run_job(app, job_id, work, stages=None):
+    """Runs work(timed) for a DeployJob, recording its status, stage timings and result."""
+    with app.app_context():
+        job = db.session.get(DeployJob, job_id)
+        job.status = 'running'
+        db.session.commit()
+        stages = list(stages or [])
+
+        def timed(name, func, *args):
+            started = time.perf_counter()
+            value = func(*args)
+            stages.append({'name': name, 'ms': round((time.perf_counter() - started) * 1000, 2)})
+            return value
+
+        try:
+            result = work(timed)
+            job.status = 'done'
+            job.result = json.dumps(result)
+        except Exception as e:
+            app.logger.exception("Deploy job %s failed", job_id)
+            db.session.rollback()
+            job = db.session.get(DeployJob, job_id)
+            job.status = 'failed'
+            job.error = str(e)
+        job.stages = json.dumps(stages)
+        db.session.commit()
+        deploy_jobs_total.inc(status=job.status)
+        for stage in stages:
+            deploy_stage_seconds.observe(stage['ms'] / 1000, stage=stage['name'])
+
+        # Finished jobs are only polled for a few seconds; keep a day of history
+        DeployJob.query.filter(DeployJob.created_at < time.time() - 86400).delete()
+        db.session.commit()
+        fail_stale_jobs()
+
+def fail_stale_jobs(job_id=None):
+    """Marks jobs (or just `job_id`) older than DEPLOY_JOB_TIMEOUT and not finished as failed.
+
+    Jobs live in the memory of the worker that queued them, so when it dies
+    they would stay queued or running forever; their upload staging
+    directories are removed too.
+    """
+    cutoff = time.time() - current_app.config['DEPLOY_JOB_TIMEOUT']
+    query = DeployJob.query.filter(DeployJob.status.in_(('queued', 'running')), DeployJob.created_at < cutoff)
+    if job_id is not None:
+        query = query.filter(DeployJob.id == job_id)
+    failed = query.update({'status': 'failed', 'error': 'Deploy timed out'}, synchronize_session='fetch')
+    db.session.commit()
+    if failed:
+        deploy_jobs_total.inc(failed, status='failed')
+    if job_id is None:
+        staging_root = current_app.config['UPLOAD_STAGING_PATH'] or tempfile.gettempdir()
+        with os.scandir(staging_root) as entries:
+            for entry in entries:
+                if entry.name.startswith(UPLOAD_STAGING_PREFIX) and entry.is_dir(follow_symlinks=False) \
+                        and entry.stat(follow_symlinks=False).st_mtime < cutoff:
+                    shutil.rmtree(entry.path, ignore_errors=True)
+    return failed
+
+def save_project_row(user_id, project_name):
+    if not Project.query.filter_by(user_id=user_id, name=project_name).first():
+        db.session.add(Project(name=project_name, user_id=user_id))
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()  # a concurrent deploy created it first
+        project_list_cache.delete(user_id)
+
+def deploy_fields(user_id, username, project_name, fields, timed):
+    """Job body for editor deploys: build the three files and write what changed."""
+    timed('db', save_project_row, user_id, project_name)
+
+    manifest = storage.read_manifest(username, project_name) or {}
+    files = {}
+    sources = {}
+    for field, source in fields.items():
+        filename = DEPLOY_FIELDS[field]
+        if filename == 'index.html':
+            files[filename] = render_index_html(username, project_name, source).encode('utf-8')
+        else:
+            files[filename] = source.encode('utf-8')
+        sources[filename] = content_hash(source.encode('utf-8'))
+
+    build = DeployBuild(username, project_name, files, sources, manifest)
+    for name in current_app.config['DEPLOY_PIPELINE']:
+        timed(name, DEPLOY_STAGES[name], build)
+
+    # Only write files whose built content or source actually changed
+    for name in list(build.files):
+        entry = manifest.get(name)
+        if entry and entry['etag'] == content_hash(build.files[name])[:32] \
+                and entry.get('source') == build.sources.get(name):
+            del build.files[name]
+    if build.files:
+        timed('write', lambda: storage.write_project(username, project_name, build.files,
+              sources=build.sources, partial=True, variants=build.variants))
+        site_cache.invalidate(username, project_name)
+        schedule_garbage_collection(username, project_name)
+    # Index the editor sources, not the built files, so lines match the IDE
+    timed('index', index_project_sources, user_id, project_name,
+          {DEPLOY_FIELDS[field]: source for field, source in fields.items()})
+
+    return {'url': f"/{username}/{project_name}", 'updated': sorted(build.files)}
+
+# A job reads the deployed manifest (and index.html) long before it writes a
+# version that carries the other files over, so two jobs for one project must
+# not interleave: the later write would silently undo the earlier one. Jobs
+# hold the project's lock from start to finish, a thread lock within this
+# process and an flock on a lock file across worker processes.
+@contextlib.contextmanager
+def project_deploy_lock(username, project_name):
+    lock_dir = current_app.config['DEPLOY_LOCK_PATH']
+    name = hashlib.sha256(f"{username}/{project_name}".encode('utf-8')).hexdigest()[:32]
+    state = runtime()
+    with state.project_locks_guard:
+        lock = state.project_locks.setdefault(name, threading.Lock())
+    os.makedirs(lock_dir, exist_ok=True)
+    with lock, open(os.path.join(lock_dir, name + '.lock'), 'wb') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def serialized(username, project_name, work):
+    """Wraps a job body so it runs under the project's deploy lock."""
+    def locked_work(timed):
+        with project_deploy_lock(username, project_name):
+            return work(timed)
+    return locked_work
+
+def enqueue_job(user, project_name, work, stages=None):
+    """Records a DeployJob and runs work(timed) on the deploy worker pool."""
+    job = DeployJob(id=secrets.token_hex(16), user_id=user.id, project_name=project_name)
+    db.session.add(job)
+    db.session.commit()
+    deploy_executor.submit(run_job, current_app._get_current_object(), job.id,
+                           serialized(user.username, project_name, work), stages)
+    return job
+
+# -------------------- ARCHIVE UPLOADS --------------------
+# Whole sites (pages, images, fonts) are uploaded as a zip or tar archive in
+# the raw request body. The body is read in chunks and extracted file by
+# file into a staging directory, so memory use does not grow with the size
+# of the site; the limits below are enforced while streaming.
+
+UPLOAD_STAGING_PREFIX = 'julu-upload-'
+
+class UploadError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+class LimitedReader:
+    """File-like view of a stream that fails once more than `limit` bytes are read."""
+
+    def __init__(self, stream, limit):
+        self.stream = stream
+        self.limit = limit
+        self.buffer = b''
+        self.count = 0
+
+    def peek(self, size):
+        while len(self.buffer) < size:
+            chunk = self.stream.read(size - len(self.buffer))
+            if not chunk:
+                break
+            self.buffer += chunk
+        return self.buffer[:size]
+
+    def read(self, size=-1):
+        if size < 0:
+            return b''.join(iter(lambda: self.read(CHUNK_SIZE), b''))
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        if len(data) < size:
+            data += self.stream.read(size - len(data))
+        self.count += len(data)
+        if self.count > self.limit:
+            raise UploadError('Upload too large', 413)
+        return data
+
+def archive_member_name(name):
+    """Normalised relative path of an archive member, or None to skip it."""
+    parts = [part for part in name.replace('\\', '/').split('/') if part not in ('', '.')]
+    if not parts or '..' in parts or name.startswith('/'):
+        return None
+    if any(part.startswith('.') for part in parts):
+        return None  # hidden files, __MACOSX metadata, our own manifest
+    return '/'.join(parts)
+
+class ArchiveExtractor:
+    """Writes archive members into a staging directory, enforcing the upload limits."""
+
+    def __init__(self, staging):
+        self.staging = staging
+        self.files = {}  # name -> staged path
+        self.total = 0
+
+    def add(self, name, source):
+        name = archive_member_name(name)
+        if name is None:
+            return
+        if name in self.files:
+            raise UploadError(f'Duplicate file in archive: {name}')
+        if len(self.files) >= current_app.config['UPLOAD_MAX_FILES']:
+            raise UploadError('Too many files in archive', 413)
+        path = os.path.join(self.staging, 'files', name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            # Sizes in archive headers can lie; count what is actually written
+            for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+                self.total += len(chunk)
+                if self.total > current_app.config['UPLOAD_MAX_TOTAL_SIZE']:
+                    raise UploadError('Archive expands beyond the size limit', 413)
+                f.write(chunk)
+        self.files[name] = path
+
+    def site_files(self):
+        """Staged files, with a single wrapping top-level folder removed."""
+        roots = {name.split('/', 1)[0] for name in self.files}
+        if len(roots) == 1 and 'index.html' not in self.files and all('/' in n for n in self.files):
+            return {name.split('/', 1)[1]: path for name, path in self.files.items()}
+        return dict(self.files)
+
+def extract_upload(stream, staging):
+    """Streams a zip or tar(.gz/.bz2/.xz) body into staging; returns {name: path}."""
+    reader = LimitedReader(stream, current_app.config['UPLOAD_MAX_BYTES'])
+    extractor = ArchiveExtractor(staging)
+    try:
+        if reader.peek(2) == b'PK':
+            # Zip keeps its directory at the end, so spool the body to disk first
+            with tempfile.TemporaryFile(dir=staging) as spool:
+                for chunk in iter(lambda: reader.read(CHUNK_SIZE), b''):
+                    spool.write(chunk)
+                spool.seek(0)
+                with zipfile.ZipFile(spool) as archive:
+                    for info in archive.infolist():
+                        if not info.is_dir():
+                            with archive.open(info) as source:
+                                extractor.add(info.filename, source)
+        else:
+            with tarfile.open(fileobj=reader, mode='r|*') as archive:
+                for member in archive:
+                    if member.isfile():
+                        extractor.add(member.name, archive.extractfile(member))
+    except (zipfile.BadZipFile, tarfile.TarError, EOFError, zlib.error) as e:
+        raise UploadError(f'Not a valid zip or tar archive ({e})')
+    files = extractor.site_files()
+    if not files:
+        raise UploadError('Archive contains no files')
+    return files
+
+def deploy_archive(user_id, username, project_name, staging, files, timed):
+    """Job body for archive uploads: replace the project with the staged files."""
+    try:
+        timed('db', save_project_row, user_id, project_name)
+        timed('write', lambda: storage.write_project(username, project_name, files))
+        site_cache.invalidate(username, project_name)
+        schedule_garbage_collection(username, project_name)
+        timed('index', index_project_sources, user_id, project_name, read_search_sources(files), True)
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+    return {'url': f"/{username}/{project_name}", 'updated': sorted(files)}
+
+# -------------------- DRAFTS --------------------
+# The IDE autosaves each tab as a server-side draft. After the first save the
+# client only sends Monaco change events ({rangeOffset, rangeLength, text})
+# against the version it last saw; a save against a stale version is refused
+# with 409 so two tabs can never silently overwrite each other.
+
+DRAFT_FIELDS = ('html', 'css', 'js')
+DEFAULT_DRAFT_PROJECT = 'untitled'
+
+class DraftConflict(Exception):
+    def __init__(self, version):
+        super().__init__(version)
+        self.version = version
+
+def apply_changes(content, changes):
+    """Applies Monaco change events, in order, to `content`.
+
+    Monaco offsets count UTF-16 code units, so the edit is done on the
+    UTF-16 encoding to stay in step with the browser beyond the BMP.
+    """
+    buffer = bytearray(content.encode('utf-16-le'))
+    for change in changes:
+        offset, length = int(change['rangeOffset']), int(change['rangeLength'])
+        if offset < 0 or length < 0 or 2 * (offset + length) > len(buffer):
+            raise ValueError('Change out of range')
+        buffer[2 * offset:2 * (offset + length)] = str(change['text']).encode('utf-16-le')
+    return buffer.decode('utf-16-le')
+
+def user_drafts(user_id, project_name=None):
+    """(project_name, {field: Draft}) for a project, by default the last one edited."""
+    if project_name is None:
+        latest = (Draft.query.filter_by(user_id=user_id)
+                  .order_by(Draft.updated_at.desc()).with_entities(Draft.project_name).first())
+        project_name = latest.project_name if latest else DEFAULT_DRAFT_PROJECT
+    drafts = Draft.query.filter_by(user_id=user_id, project_name=project_name).all()
+    return project_name, {draft.field: draft for draft in drafts}
+
+def save_draft(user_id, project_name, field, base_version, content=None, changes=None):
+    """Stores a whole new `content` or applies `changes`; returns the new version.
+
+    `base_version` is 0 for a draft that does not exist yet. The update is a
+    compare-and-swap on the version column, so it is safe across workers.
+    """
+    draft = Draft.query.filter_by(user_id=user_id, project_name=project_name, field=field).first()
+    current = draft.version if draft else 0
+    if current != base_version:
+        raise DraftConflict(current)
+    if content is None:
+        content = apply_changes(draft.content if draft else '', changes)
+    if len(content) > current_app.config['DRAFT_MAX_CHARS']:
+        raise ValueError('Draft too large')
+
+    if draft is None:
+        db.session.add(Draft(user_id=user_id, project_name=project_name, field=field, content=content))
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()  # created concurrently by another tab
+            raise DraftConflict(draft_version(user_id, project_name, field))
+        return 1
+
+    updated = (Draft.query.filter_by(id=draft.id, version=base_version)
+               .update({'content': content, 'version': base_version + 1, 'updated_at': time.time()}))
+    db.session.commit()
+    if not updated:
+        raise DraftConflict(draft_version(user_id, project_name, field))
+    return base_version + 1
+
+def draft_version(user_id, project_name, field):
+    row = (Draft.query.filter_by(user_id=user_id, project_name=project_name, field=field)
+           .with_entities(Draft.version).first())
+    return row.version if row else 0
+
+# -------------------- SEARCH --------------------
+# Deployed HTML/CSS/JS is searchable with SQLite FTS5. Files are indexed in
+# chunks of SEARCH_CHUNK_LINES lines, so a hit can point at a line; a chunk's
+# rowid is its file's SearchFile.id * SEARCH_ROWID_STRIDE + its number, which
+# lets a changed file's chunks be dropped by rowid range. Each chunk also
+# carries an owner token ("u<user id>") and queries match on it, so FTS only
+# walks the current user's documents. Deploy jobs re-index just the files
+# whose source hash changed. Rollbacks are not re-indexed: search follows
+# the latest deploy. Without SQLite (no FTS5) search is disabled.
+
+SEARCH_EXTENSIONS = ('.html', '.htm', '.css', '.js')
+SEARCH_CHUNK_LINES = 8
+SEARCH_ROWID_STRIDE = 1 << 20  # chunks per file, more than SEARCH_MAX_FILE_CHARS can need
+SEARCH_MAX_TERMS = 8
+SEARCH_TABLE_SQL = ("CREATE VIRTUAL TABLE IF NOT EXISTS search_chunk USING fts5("
+                    "content, owner, line UNINDEXED, tokenize = \"unicode61 tokenchars '-_'\")")
+
+def search_enabled():
+    return db.engine.dialect.name == 'sqlite'
+
+def drop_search_chunks(file_id):
+    db.session.execute(text('DELETE FROM search_chunk WHERE rowid >= :low AND rowid < :high'),
+                       {'low': file_id * SEARCH_ROWID_STRIDE, 'high': (file_id + 1) * SEARCH_ROWID_STRIDE})
+
+def index_project_sources(user_id, project_name, sources, replace=False):
+    """Brings the index of a project up to date with `sources` ({filename: text}).
+
+    Only files whose content changed are re-indexed. With replace=True,
+    indexed files missing from `sources` are dropped. Returns how many
+    files were (re-)indexed.
+    """
+    if not search_enabled():
+        return 0
+    max_chars = current_app.config['SEARCH_MAX_FILE_CHARS']
+    indexed = {f.filename: f for f in SearchFile.query.filter_by(user_id=user_id, project_name=project_name)}
+    changed = 0
+    for filename, source in sources.items():
+        digest = content_hash(source.encode('utf-8'))
+        entry = indexed.get(filename)
+        if entry is not None and entry.content_hash == digest:
+            continue
+        if entry is None:
+            entry = SearchFile(user_id=user_id, project_name=project_name, filename=filename, content_hash=digest)
+            db.session.add(entry)
+            db.session.flush()  # for the id
+        else:
+            entry.content_hash = digest
+            drop_search_chunks(entry.id)
+        lines = source[:max_chars].splitlines()
+        rows = [{'rowid': entry.id * SEARCH_ROWID_STRIDE + n, 'owner': f"u{user_id}", 'line': start + 1,
+                 'content': '\n'.join(lines[start:start + SEARCH_CHUNK_LINES])}
+                for n, start in enumerate(range(0, len(lines), SEARCH_CHUNK_LINES))]
+        if rows:
+            db.session.execute(text('INSERT INTO search_chunk (rowid, content, owner, line) '
+                                    'VALUES (:rowid, :content, :owner, :line)'), rows)
+        changed += 1
+    if replace:
+        for filename, entry in indexed.items():
+            if filename not in sources:
+                drop_search_chunks(entry.id)
+                db.session.delete(entry)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Another deploy of this project indexed the same new file first
+        db.session.rollback()
+        current_app.logger.warning("Search index race for project %s of user %s", project_name, user_id)
+        return 0
+    return changed
+
+def read_search_sources(files):
+    """The searchable text files among staged upload files ({name: path})."""
+    max_chars = current_app.config['SEARCH_MAX_FILE_CHARS']
+    sources = {}
+    for name, path in files.items():
+        if name.lower().endswith(SEARCH_EXTENSIONS) and os.path.getsize(path) <= 4 * max_chars:
+            with open(path, encoding='utf-8', errors='replace') as f:
+                sources[name] = f.read(max_chars)
+    return sources
+
+def search_terms(query):
+    return re.findall(r'[\w-]+', query)[:SEARCH_MAX_TERMS]
+
+def search_sources(user_id, query, project_name=None, limit=20):
+    """Best matches for `query` in a user's deployed sources, ranked by bm25.
+
+    Every word of the query must occur, as a prefix of a token. Returns
+    dicts with project, file, line and an HTML snippet where matches are
+    wrapped in <mark> and everything else is escaped.
+    """
+    terms = search_terms(query)
+    if not terms or not search_enabled():
+        return []
+    # Quoted, so the words are never read as FTS5 operators; terms hold no quotes
+    match = f'owner:u{user_id} AND content:(' + ' '.join(f'"{term}"*' for term in terms) + ')'
+    sql = ("SELECT f.project_name, f.filename, c.line, c.content, "
+           "snippet(search_chunk, 0, char(1), char(2), '…', 16) "
+           "FROM search_chunk c JOIN search_file f ON f.id = c.rowid / :stride "
+           "WHERE search_chunk MATCH :match AND f.user_id = :user_id"
+           + (" AND f.project_name = :project_name" if project_name else "") +
+           " ORDER BY bm25(search_chunk) LIMIT :limit")
+    rows = db.session.execute(text(sql), {'stride': SEARCH_ROWID_STRIDE, 'match': match, 'user_id': user_id,
+                                          'project_name': project_name, 'limit': limit})
+    lowered = [term.lower() for term in terms]
+    hits = []
+    for project, filename, line, content, snippet in rows:
+        # Narrow the chunk down to the first line with a match
+        for offset, text_line in enumerate(content.split('\n')):
+            if any(term in text_line.lower() for term in lowered):
+                line += offset
+                break
+        hits.append({
+            'project': project,
+            'file': filename,
+            'line': line,
+            'snippet': str(escape(snippet)).replace('\x01', '<mark>').replace('\x02', '</mark>'),
+        })
+    return hits
+
+# -------------------- METRICS --------------------
+# In-process counters and histograms, exported in the Prometheus text format
+# on /metrics. Each worker process keeps and reports its own numbers, so
+# scrape every worker (or sum them) when running several.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+METRICS = []
+
+def format_labels(names, values, extra=()):
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in pairs) + '}'
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.values = {}
+        self.lock = threading.Lock()
+        METRICS.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(label, '') for label in self.labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            return [(self.name + format_labels(self.labels, key), value) for key, value in sorted(self.values.items())]
+
+class Histogram(Counter):
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = buckets
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(label, '') for label in self.labels)
+        with self.lock:
+            counts = self.values.get(key)
+            if counts is None:
+                counts = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0]  # buckets, +Inf, sum
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[len(self.buckets)] += 1
+            counts[-1] += value
+
+    def samples(self):
+        lines = []
+        with self.lock:
+            items = sorted((key, list(counts)) for key, counts in self.values.items())
+        for key, counts in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                lines.append((self.name + '_bucket' + format_labels(self.labels, key, [('le', bound)]), cumulative))
+            lines.append((self.name + '_sum' + format_labels(self.labels, key), round(counts[-1], 6)))
+            lines.append((self.name + '_count' + format_labels(self.labels, key), cumulative))
+        return lines
+
+http_request_seconds = Histogram('julu_http_request_duration_seconds', 'Request latency by endpoint.', ('endpoint', 'method'))
+http_requests_total = Counter('julu_http_requests_total', 'Requests by endpoint and status.', ('endpoint', 'method', 'status'))
+http_response_bytes = Counter('julu_http_response_bytes_total', 'Response body bytes sent, by endpoint.', ('endpoint',))
+db_queries_total = Counter('julu_db_queries_total', 'SQL statements executed, by endpoint.', ('endpoint',))
+db_query_seconds = Histogram('julu_db_query_duration_seconds', 'SQL statement latency.', (),
+                             buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0))
+template_render_seconds = Histogram('julu_template_render_duration_seconds', 'Jinja rendering time by template.', ('template',))
+storage_bytes_written = Counter('julu_storage_bytes_written_total', 'File bytes written by the storage backend.', ('backend',))
+deploy_stage_seconds = Histogram('julu_deploy_stage_duration_seconds', 'Deploy job stage timings.', ('stage',))
+deploy_jobs_total = Counter('julu_deploy_jobs_total', 'Finished deploy jobs by outcome.', ('status',))
+
+def render_metrics():
+    lines = []
+    for metric in METRICS:
+        lines.append(f"# HELP {metric.name} {metric.help_text}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(f"{name} {value}" for name, value in metric.samples())
+    for key, value in site_cache.stats().items():
+        kind = 'counter' if key in ('hits', 'misses', 'evictions', 'invalidations') else 'gauge'
+        name = f"julu_site_cache_{key}" + ('_total' if kind == 'counter' else '')
+        lines.append(f"# TYPE {name} {kind}")
+        lines.append(f"{name} {value}")
+    return '\n'.join(lines) + '\n'
+
+# Per-request breakdown, kept on g: [queries, db seconds, template seconds].
+# The query timers are added to each engine by create_app().
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+def drop_query_timer(exception_context):
+    """'handle_error' listener: a failed statement never reaches stop_query_timer."""
+    conn = exception_context.connection
+    if exception_context.statement is not None and conn is not None and conn.info.get('query_started'):
+        conn.info['query_started'].pop()
+
+def stop_query_timer(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_started'].pop()
+    db_query_seconds.observe(elapsed)
+    if has_app_context() and 'request_breakdown' in g:
+        g.request_breakdown[0] += 1
+        g.request_breakdown[1] += elapsed
+
+@before_render_template.connect
+def start_template_timer(sender, template, context, **extra):
+    if has_app_context():
+        g.setdefault('template_started', []).append(time.perf_counter())
+
+@template_rendered.connect
+def stop_template_timer(sender, template, context, **extra):
+    if not has_app_context() or not g.get('template_started'):
+        return
+    elapsed = time.perf_counter() - g.template_started.pop()
+    template_render_seconds.observe(elapsed, template=template.name or 'string')
+    if 'request_breakdown' in g:
+        g.request_breakdown[2] += elapsed
+
+@bp.before_app_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    g.request_breakdown = [0, 0.0, 0.0]
+
+@bp.after_app_request
+def record_request_metrics(response):
+    if 'request_started' not in g:
+        return response
+    elapsed = time.perf_counter() - g.request_started
+    endpoint = (request.endpoint or 'unmatched').rsplit('.', 1)[-1]  # without the blueprint name
+    queries, db_seconds, template_seconds = g.request_breakdown
+    http_request_seconds.observe(elapsed, endpoint=endpoint, method=request.method)
+    http_requests_total.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+    http_response_bytes.inc(response.content_length or 0, endpoint=endpoint)
+    if queries:
+        db_queries_total.inc(queries, endpoint=endpoint)
+
+    threshold = current_app.config['SLOW_REQUEST_SECONDS']
+    if threshold is not None and elapsed >= threshold:
+        current_app.logger.warning(
+            "Slow request %s %s -> %s in %.1f ms (db: %d queries, %.1f ms; templates: %.1f ms; other: %.1f ms; %s bytes)",
+            request.method, request.full_path.rstrip('?'), response.status_code, elapsed * 1000,
+            queries, db_seconds * 1000, template_seconds * 1000,
+            (elapsed - db_seconds - template_seconds) * 1000, response.content_length)
+    return response
+
 # -------------------- ROUTES --------------------
 
-@app.route('/')
+@bp.route('/')
 def home():
-    if 'user_id' not in session:
-        return redirect('/login')
-    
-    user = User.query.get(session['user_id'])
-    if not user:
+    user = current_user()
+    if user is None:
         session.clear()
         return redirect('/login')
         
-    projects = Project.query.filter_by(user_id=user.id).all()
-    return render_template_string(IDE_HTML, user=user, projects=projects)
+    body, etag = ide_shell()
+    response = make_response(body)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response.make_conditional(request)
+
+# Small per-user fragment of the IDE page (username, account block)
+@bp.route('/ide/session')
+def ide_session():
+    user = current_user()
+    if user is None:
+        session.clear()
+        return "Unauthorized", 401
+
+    response = make_response(render_template('ide_session.html', user=user))
+    response.headers['Cache-Control'] = 'private, no-store'
+    return response
 
-@app.route('/login', methods=['GET', 'POST'])
+LOGIN_PAGE = dict(btn_text="Login", link_text="New here?", link_label="Create Account", link_url="/signup")
+SIGNUP_PAGE = dict(btn_text="Sign Up", link_text="Already have an account?", link_label="Login", link_url="/login")
+
+@bp.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
         username = request.form['username']
         password = request.form['password']
+        wait = max(login_ip_limiter.allow(request.remote_addr), login_username_limiter.allow(username))
+        if wait:
+            return auth_refusal(LOGIN_PAGE, 'Too many login attempts, try again later', 429, wait)
+
         user = User.query.filter_by(username=username).first()
-        if user and user.password == password:
+        try:
+            ok, needs_rehash = verify_password(user.password if user else None, password)
+        except PasswordBusy:
+            return auth_refusal(LOGIN_PAGE, 'Server busy, try again in a moment', 503, 1)
+        if ok and needs_rehash:
+            try:
+                user.password = hash_password(password)
+                db.session.commit()
+            except PasswordBusy:
+                pass  # upgraded on a later login
+        if ok:
             session['user_id'] = user.id
             session['username'] = user.username
             return redirect('/')
         flash('Invalid credentials')
-    return render_template_string(AUTH_HTML, btn_text="Login", link_text="New here?", link_label="Create Account", link_url="/signup")
+    return render_template('auth.html', **LOGIN_PAGE)
+
+def reserved_usernames():
+    """First path segments of the app's own routes (/api, /assets, /static, ...).
+
+    Sites are served at /<username>/<project>, so a user named after one of
+    them could never be reached.
+    """
+    return {rule.rule.split('/')[1].lower() for rule in current_app.url_map.iter_rules()
+            if not rule.rule.startswith('/<')}
 
-@app.route('/signup', methods=['GET', 'POST'])
+@bp.route('/signup', methods=['GET', 'POST'])
 def signup():
     if request.method == 'POST':
         username = request.form['username']
         password = request.form['password']
-        if User.query.filter_by(username=username).first():
+        wait = signup_ip_limiter.allow(request.remote_addr)
+        if wait:
+            return auth_refusal(SIGNUP_PAGE, 'Too many signups, try again later', 429, wait)
+
+        if username.lower() in reserved_usernames() or User.query.filter_by(username=username).first():
             flash('Username taken')
         else:
-            new_user = User(username=username, password=password)
+            try:
+                new_user = User(username=username, password=hash_password(password))
+            except PasswordBusy:
+                return auth_refusal(SIGNUP_PAGE, 'Server busy, try again in a moment', 503, 1)
             db.session.add(new_user)
-            db.session.commit()
+            try:
+                db.session.commit()
+            except IntegrityError:
+                db.session.rollback()  # taken while we were hashing
+                flash('Username taken')
+                return render_template('auth.html', **SIGNUP_PAGE)
+            forget_user(new_user.id)  # SQLite may hand out a deleted user's id again
             return redirect('/login')
-    return render_template_string(AUTH_HTML, btn_text="Sign Up", link_text="Already have an account?", link_label="Login", link_url="/login")
+    return render_template('auth.html', **SIGNUP_PAGE)
 
-@app.route('/logout')
+@bp.route('/logout')
 def logout():
     session.clear()
     return redirect('/login')
 
 # API for AJAX Deployment from Editor
-@app.route('/deploy_api', methods=['POST'])
+@bp.route('/deploy_api', methods=['POST'])
 def deploy_api():
-    if 'user_id' not in session:
+    user = current_user()
+    if user is None:
         return jsonify({'success': False, 'error': 'Unauthorized'}), 401
-    
-    user = User.query.get(session['user_id'])
     project_name = request.form.get('project_name', '').strip().replace(' ', '-')
     
     if not project_name:
         return jsonify({'success': False, 'error': 'Project name required'})
+    if project_name.startswith('.') or '/' in project_name or '\\' in project_name:
+        return jsonify({'success': False, 'error': 'Invalid project name'})
 
-    # Save to DB
-    if not Project.query.filter_by(user_id=user.id, name=project_name).first():
-        db.session.add(Project(name=project_name, owner=user))
-        db.session.commit()
-    
-    # Save Files
-    path = os.path.join(PROJECTS_FOLDER, user.username, project_name)
-    os.makedirs(path, exist_ok=True)
-    
-    with open(os.path.join(path, 'style.css'), 'w') as f: f.write(request.form.get('css_code', ''))
-    with open(os.path.join(path, 'script.js'), 'w') as f: f.write(request.form.get('js_code', ''))
-    
-    full_html = f"""<!DOCTYPE html>
-<html>
-<head>
-<title>{project_name}</title>
-<meta name="viewport" content="width=device-width, initial-scale=1.0">
-<link rel="stylesheet" href="/{user.username}/{project_name}/style.css">
-</head>
-<body>
-{request.form.get('html_code', '')}
-<script src="/{user.username}/{project_name}/script.js"></script>
-</body>
-</html>"""
-    
-    with open(os.path.join(path, 'index.html'), 'w') as f: f.write(full_html)
-    
-    return jsonify({'success': True, 'url': f"/{user.username}/{project_name}"})
+    # Delta deploys: the client may leave out fields whose sha256 (in
+    # 'hashes') matches what is already deployed. Anything else must be sent.
+    try:
+        hashes = json.loads(request.form.get('hashes') or '{}')
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Invalid hashes'}), 400
+    if not isinstance(hashes, dict) or not all(isinstance(v, str) for v in hashes.values()):
+        return jsonify({'success': False, 'error': 'Invalid hashes'}), 400
+    manifest = storage.read_manifest(user.username, project_name) or {}
+    needed = [field for field, filename in DEPLOY_FIELDS.items()
+              if field not in request.form and not source_matches(manifest.get(filename), hashes.get(field))]
+    if needed:
+        return jsonify({'success': False, 'error': 'Upload required', 'needed': needed}), 409
+
+    # multipart/form-data turns the editor's LF line endings into CRLF, but the
+    # client hashed the text as typed; store and build what was typed
+    fields = {field: request.form[field].replace('\r\n', '\n') for field in DEPLOY_FIELDS if field in request.form}
+    job = enqueue_job(user, project_name, functools.partial(deploy_fields, user.id, user.username, project_name, fields))
+    return jsonify({'success': True, 'job_id': job.id, 'status_url': f"/api/jobs/{job.id}"}), 202
+
+# Upload a whole site as a zip/tar archive in the raw request body
+@bp.route('/upload_api', methods=['POST'])
+def upload_api():
+    user = current_user()
+    if user is None:
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 401
+    # The body is the archive, so the name comes from the query string
+    project_name = request.args.get('project_name', '').strip().replace(' ', '-')
+
+    if not project_name:
+        return jsonify({'success': False, 'error': 'Project name required'})
+    if project_name.startswith('.') or '/' in project_name or '\\' in project_name:
+        return jsonify({'success': False, 'error': 'Invalid project name'})
+    if (request.content_length or 0) > current_app.config['UPLOAD_MAX_BYTES']:
+        return jsonify({'success': False, 'error': 'Upload too large'}), 413
+
+    staging = tempfile.mkdtemp(prefix=UPLOAD_STAGING_PREFIX, dir=current_app.config['UPLOAD_STAGING_PATH'])
+    started = time.perf_counter()
+    try:
+        files = extract_upload(request.stream, staging)
+    except UploadError as e:
+        shutil.rmtree(staging, ignore_errors=True)
+        return jsonify({'success': False, 'error': str(e)}), e.status
+    extract_stage = {'name': 'extract', 'ms': round((time.perf_counter() - started) * 1000, 2)}
+
+    job = enqueue_job(user, project_name,
+                      functools.partial(deploy_archive, user.id, user.username, project_name, staging, files),
+                      stages=[extract_stage])
+    return jsonify({'success': True, 'job_id': job.id, 'status_url': f"/api/jobs/{job.id}"}), 202
+
+# Status of a queued deploy, polled by the IDE
+@bp.route('/api/jobs/<job_id>')
+def job_status(job_id):
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 401
+
+    job = db.session.get(DeployJob, job_id)
+    if job is None or job.user_id != session['user_id']:
+        return jsonify({'success': False, 'error': 'Job not found'}), 404
+    if job.status in ('queued', 'running') and fail_stale_jobs(job_id):
+        db.session.refresh(job)
+    return jsonify({'success': True, 'job': job.to_dict()})
+
+# Sidebar project list, one keyset page at a time (?after=<name>&prefix=&limit=)
+@bp.route('/api/projects')
+def list_projects():
+    user = current_user()
+    if user is None:
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 401
+
+    try:
+        limit = min(max(int(request.args.get('limit', PROJECT_PAGE_SIZE)), 1), PROJECT_PAGE_MAX)
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Invalid limit'}), 400
+    projects, next_cursor = project_page(user.id, after=request.args.get('after') or None,
+                                         prefix=request.args.get('prefix', '').strip(), limit=limit)
+    response = jsonify({
+        'success': True,
+        'projects': [{'name': p.name, 'url': f"/{user.username}/{p.name}"} for p in projects],
+        'next': next_cursor,
+    })
+    response.headers['Cache-Control'] = 'private, no-store'
+    return response
+
+# Full-text search over the current user's deployed sources (?q=&project=&limit=)
+@bp.route('/api/search')
+def search_api():
+    user = current_user()
+    if user is None:
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 401
+
+    query = request.args.get('q', '').strip()
+    if not search_terms(query):
+        return jsonify({'success': False, 'error': 'Query required'}), 400
+    try:
+        limit = min(max(int(request.args.get('limit', 20)), 1), 100)
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Invalid limit'}), 400
+    hits = search_sources(user.id, query, request.args.get('project') or None, limit)
+    for hit in hits:
+        hit['url'] = f"/{user.username}/{hit['project']}" + ('' if hit['file'] == 'index.html' else f"/{hit['file']}")
+    response = jsonify({'success': True, 'hits': hits})
+    response.headers['Cache-Control'] = 'private, no-store'
+    return response
+
+# Autosaved editor tabs of a project (?project=, default: the last one edited)
+@bp.route('/api/drafts')
+def get_drafts():
+    user = current_user()
+    if user is None:
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 401
+
+    project_name, drafts = user_drafts(user.id, request.args.get('project') or None)
+    response = jsonify({
+        'success': True,
+        'project': project_name,
+        'files': {field: {'content': d.content, 'version': d.version} for field, d in drafts.items()},
+    })
+    response.headers['Cache-Control'] = 'private, no-store'
+    return response
+
+# Save one tab: {"base_version": n, "changes": [...]} or {"base_version": n, "content": "..."}
+@bp.route('/api/drafts/<project_name>/<field>', methods=['PATCH'])
+def patch_draft(project_name, field):
+    user = current_user()
+    if user is None:
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 401
+    if field not in DRAFT_FIELDS:
+        return jsonify({'success': False, 'error': 'Unknown file'}), 404
+    if project_name.startswith('.') or '\\' in project_name:
+        return jsonify({'success': False, 'error': 'Invalid project name'}), 400
+
+    data = request.get_json(silent=True) or {}
+    content, changes = data.get('content'), data.get('changes')
+    if not isinstance(data.get('base_version'), int) or \
+            not (isinstance(content, str) or isinstance(changes, list)):
+        return jsonify({'success': False, 'error': 'Expected base_version and changes or content'}), 400
+    try:
+        version = save_draft(user.id, project_name, field, data['base_version'],
+                             content=content if isinstance(content, str) else None, changes=changes)
+    except DraftConflict as e:
+        return jsonify({'success': False, 'error': 'Draft changed elsewhere', 'version': e.version}), 409
+    except (KeyError, TypeError):
+        return jsonify({'success': False, 'error': 'Invalid change'}), 400
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    return jsonify({'success': True, 'version': version})
+
+# Deploy history of one of the current user's projects
+@bp.route('/api/projects/<project_name>/versions')
+def project_versions(project_name):
+    user = current_user()
+    if user is None:
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 401
+    return jsonify({'success': True, 'versions': storage.list_versions(user.username, project_name)})
+
+# Instant rollback: re-points the project at an older version, no files rewritten
+@bp.route('/api/projects/<project_name>/rollback', methods=['POST'])
+def rollback_project(project_name):
+    user = current_user()
+    if user is None:
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 401
+    version = request.form.get('version') or (request.get_json(silent=True) or {}).get('version')
+    if not version or not isinstance(version, str):
+        return jsonify({'success': False, 'error': 'Version required'}), 400
+    try:
+        storage.activate(user.username, project_name, version)
+    except KeyError:
+        return jsonify({'success': False, 'error': 'Unknown version'}), 404
+    site_cache.invalidate(user.username, project_name)
+    return jsonify({'success': True, 'version': version})
+
+def metrics_allowed():
+    token = current_app.config['METRICS_TOKEN']
+    if token:
+        return secrets.compare_digest(request.headers.get('Authorization', ''), f"Bearer {token}")
+    if not current_app.config['TRUSTED_PROXIES']:
+        return False
+    return request.remote_addr in ('127.0.0.1', '::1')
+
+# Prometheus scrape target (see METRICS)
+@bp.route('/metrics')
+def metrics():
+    if not metrics_allowed():
+        return "Unauthorized", 401
+    response = make_response(render_metrics())
+    response.headers['Content-Type'] = 'text/plain; version=0.0.4; charset=utf-8'
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+# Counters for sizing the deployed-site cache
+@bp.route('/api/cache_stats')
+def cache_stats():
+    if not metrics_allowed():
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 401
+    return jsonify(site_cache.stats())
+
+# Fingerprinted front-end bundle (see build_assets); names change with content
+@bp.route('/assets/<path:filename>')
+def serve_asset(filename):
+    path = safe_join(current_app.config['ASSETS_PATH'], filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    if filename == ASSET_MANIFEST_NAME:
+        return send_file(path, max_age=0)
+
+    encoding = choose_encoding([e for e, suffix in ENCODING_SUFFIXES.items() if os.path.isfile(path + suffix)])
+    response = send_file(path + ENCODING_SUFFIXES[encoding] if encoding else path,
+                         mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = current_app.config['DEPLOY_IMMUTABLE_CACHE_CONTROL']
+    return response
 
 # Serve Deployed Projects
-@app.route('/<username>/<project_name>')
+@bp.route('/<username>/<project_name>')
 def view_project(username, project_name):
-    path = os.path.join(PROJECTS_FOLDER, username, project_name)
-    if os.path.exists(path):
-        return send_from_directory(path, 'index.html')
-    return "Project not found", 404
+    response = serve_deployed_file(username, project_name, 'index.html')
+    if response is None:
+        return "Project not found", 404
+    return response
 
-@app.route('/<username>/<project_name>/<filename>')
+@bp.route('/<username>/<project_name>/<path:filename>')
 def view_project_files(username, project_name, filename):
-    return send_from_directory(os.path.join(PROJECTS_FOLDER, username, project_name), filename)
+    response = serve_deployed_file(username, project_name, filename)
+    if response is None:
+        abort(404)
+    return response
+
+# -------------------- EXPORT / IMPORT --------------------
+# `flask export` writes a whole instance to one .tar.gz: a consistent copy of
+# the database, taken with SQLite's online backup API while the app keeps
+# serving, plus the active version of every project. The archive is a run of
+# gzip members, one per project, each holding a small tar; gzip sees one
+# stream and the tar reader skips the end-of-archive blocks in between
+# (ignore_zeros). After each member the archive size goes to
+# <archive>.journal, so an interrupted export resumes by cutting the archive
+# back to the last complete member. `flask import` restores an archive into
+# an empty instance and journals finished projects the same way.
+#
+# Projects are read (export) or written (import) on a thread pool; a
+# ByteBudget caps the file data held in memory at once.
+
+EXPORT_FORMAT = 1
+EXPORT_HEADER_NAME = 'julu-export.json'
+EXPORT_DATABASE_NAME = 'database.sqlite'
+
+class ByteBudget:
+    """Blocks acquire() while more than `limit` bytes are checked out.
+
+    A request larger than the limit is capped to it, so it waits until it
+    has the budget to itself rather than forever.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self.closed = False
+        self.condition = threading.Condition()
+
+    def acquire(self, size):
+        size = min(size, self.limit)
+        with self.condition:
+            while self.used and self.used + size > self.limit and not self.closed:
+                self.condition.wait()
+            self.used += size
+        return size
+
+    def release(self, size):
+        with self.condition:
+            self.used -= size
+            self.condition.notify_all()
+
+    def close(self):
+        """Lets every waiter through, for shutting down early."""
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+@contextlib.contextmanager
+def raw_sqlite_connection():
+    """The sqlite3 connection behind a pooled engine connection."""
+    if db.engine.dialect.name != 'sqlite':
+        raise click.ClickException('Export and import need an SQLite database')
+    connection = db.engine.raw_connection()
+    try:
+        yield connection.driver_connection
+    finally:
+        connection.close()
+
+def snapshot_database(path):
+    target = sqlite3.connect(path)
+    try:
+        with raw_sqlite_connection() as source:
+            # In steps, so the app can keep writing; SQLite restarts the copy
+            # if it does, and the result is always a consistent snapshot
+            source.backup(target, pages=1024)
+    finally:
+        target.close()
+
+def restore_database(path):
+    db.session.remove()
+    source = sqlite3.connect(path)
+    try:
+        with raw_sqlite_connection() as target:
+            source.backup(target)
+    finally:
+        source.close()
+    db.engine.dispose()  # other pooled connections may have cached the old schema
+
+def write_export_member(out, entries):
+    """Appends one gzip member holding a tar of `entries` ([(name, bytes or path)])."""
+    with gzip.GzipFile(fileobj=out, mode='wb', compresslevel=6, mtime=0) as gz:
+        with tarfile.open(fileobj=gz, mode='w|', format=tarfile.PAX_FORMAT) as tar:
+            for name, data in entries:
+                if isinstance(data, str):
+                    tar.add(data, arcname=name, recursive=False)
+                    continue
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                info.mtime = int(time.time())
+                tar.addfile(info, io.BytesIO(data))
+
+def append_journal(journal, out, entry):
+    """Records `entry` once everything written to `out` so far is on disk."""
+    if out is not None:
+        out.flush()
+        os.fsync(out.fileno())
+        entry['offset'] = out.tell()
+    journal.write(json.dumps(entry) + '\n')
+    journal.flush()
+    os.fsync(journal.fileno())
+
+def read_journal(path):
+    try:
+        with open(path) as f:
+            data = f.read()
+    except FileNotFoundError:
+        return []
+    return [json.loads(line) for line in data[:data.rfind('\n') + 1].splitlines()]  # ignore a torn last line
+
+def read_export_project(app, budget, username, project_name):
+    """Reads the active version of a project; returns (meta, files, reserved bytes)."""
+    with app.app_context():
+        for attempt in range(3):
+            # Pin the version: a deploy or GC while we read must not mix versions
+            version = storage.current_version(username, project_name)
+            manifest = storage.read_manifest(username, project_name, version) or {}
+            reserved = budget.acquire(sum(entry.get('size', 0) for entry in manifest.values()))
+            files = {name: storage.read_file(username, project_name, name, version=version) for name in manifest}
+            if None not in files.values():
+                break
+            budget.release(reserved)  # version pruned underneath us, read the new one
+        else:
+            raise RuntimeError(f"{username}/{project_name} kept changing while it was read")
+        meta = {'username': username, 'project': project_name, 'version': version,
+                'size': sum(len(data) for data in files.values()),
+                'sources': {name: entry['source'] for name, entry in manifest.items() if 'source' in entry}}
+        return meta, files, reserved
+
+def export_instance(archive, workers, buffer_bytes, resume=False, report=None):
+    """Writes the instance to `archive` ('-' for stdout); returns (projects written, failures)."""
+    report = report or (lambda done, total, size: None)
+    app = current_app._get_current_object()
+    journal_path = archive + '.journal'
+    if archive == '-':
+        if resume:
+            raise click.UsageError('An export to stdout cannot be resumed')
+        out, journal = sys.stdout.buffer, None
+    elif resume:
+        entries = read_journal(journal_path)
+        if not entries:
+            raise click.ClickException(f"No interrupted export of {archive} to resume")
+        out = open(archive, 'r+b')
+        out.truncate(entries[-1]['offset'])  # drop a half-written member
+        out.seek(entries[-1]['offset'])
+        journal = open(journal_path, 'a')
+    else:
+        if os.path.exists(archive):
+            raise click.ClickException(f"{archive} already exists; remove it or pass --resume")
+        out, journal = open(archive, 'wb'), open(journal_path, 'w')
+
+    budget = ByteBudget(buffer_bytes)
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='export')
+    written, failures, size = 0, [], 0
+    try:
+        if resume:
+            projects = [tuple(key) for key in entries[0]['projects']]
+            done = {entry['index'] for entry in entries[1:]}
+        else:
+            with tempfile.TemporaryDirectory() as tmp:
+                snapshot = os.path.join(tmp, EXPORT_DATABASE_NAME)
+                snapshot_database(snapshot)
+                projects = sorted(storage.iter_projects())
+                header = {'format': EXPORT_FORMAT, 'schema_version': SCHEMA_VERSION,
+                          'created': time.time(), 'projects': len(projects)}
+                write_export_member(out, [(EXPORT_HEADER_NAME, json.dumps(header).encode('utf-8')),
+                                          (EXPORT_DATABASE_NAME, snapshot)])
+            if journal is not None:
+                append_journal(journal, out, {'projects': projects})
+            done = set()
+
+        report(len(done), len(projects), size)
+        futures = {pool.submit(read_export_project, app, budget, *key): index
+                   for index, key in enumerate(projects) if index not in done}
+        for future in as_completed(futures):
+            index = futures[future]
+            try:
+                meta, files, reserved = future.result()
+            except Exception as e:
+                failures.append(f"{'/'.join(projects[index])}: {e}")
+                continue
+            try:
+                prefix = f"projects/{index:06d}/"
+                write_export_member(out, [(prefix + 'project.json', json.dumps(meta).encode('utf-8'))] +
+                                         [(prefix + 'files/' + name, data) for name, data in files.items()])
+                size += meta['size']
+            finally:
+                budget.release(reserved)
+            if journal is not None:
+                append_journal(journal, out, {'index': index})
+            written += 1
+            done.add(index)
+            report(len(done), len(projects), size)
+    finally:
+        budget.close()  # readers may be waiting for budget nobody will release
+        pool.shutdown(cancel_futures=True)
+        out.flush()
+        if journal is not None:
+            journal.close()
+            out.close()
+
+    if journal is not None and not failures:
+        os.remove(journal_path)  # complete; failed projects stay resumable
+    return written, failures
+
+def import_project_name(name):
+    return bool(name) and not name.startswith('.') and '/' not in name and '\\' not in name
+
+def write_import_project(app, meta, files):
+    with app.app_context():
+        storage.write_project(meta['username'], meta['project'], files, sources=meta['sources'])
+
+def import_instance(archive, workers, buffer_bytes, resume=False, report=None):
+    """Restores `archive` ('-' for stdin) into this instance; returns (projects written, failures)."""
+    report = report or (lambda done, total, size: None)
+    app = current_app._get_current_object()
+    journal_path = archive + '.import-journal'
+    if resume and archive == '-':
+        raise click.UsageError('An import from stdin cannot be resumed')
+    entries = read_journal(journal_path) if resume else []
+    if resume and not entries:
+        raise click.ClickException(f"No interrupted import of {archive} to resume")
+    database_restored = any(entry.get('database') for entry in entries)
+    done = {entry['index'] for entry in entries if 'index' in entry}
+    if not resume:
+        db.create_all()
+        if User.query.first() is not None:
+            raise click.ClickException('This instance already has users; import into an empty database')
+
+    journal = None if archive == '-' else open(journal_path, 'a' if resume else 'w')
+    journal_lock = threading.Lock()
+    budget = ByteBudget(buffer_bytes)
+    failures = []
+    progress = {'done': len(done), 'total': 0, 'size': 0, 'written': 0}
+
+    def finished(index, meta, size, reserved, future):
+        budget.release(reserved)
+        with journal_lock:
+            if future.exception() is not None:
+                failures.append(f"{meta['username']}/{meta['project']}: {future.exception()}")
+                return
+            if journal is not None:
+                append_journal(journal, None, {'index': index})
+            progress['done'] += 1
+            progress['written'] += 1
+            progress['size'] += size
+            report(progress['done'], progress['total'], progress['size'])
+
+    def submit(project):
+        if project is None:
+            return
+        index, meta, files, reserved = project
+        future = pool.submit(write_import_project, app, meta, files)
+        future.add_done_callback(functools.partial(finished, index, meta, meta['size'], reserved))
+
+    source = sys.stdin.buffer if archive == '-' else open(archive, 'rb')
+    project = None  # (index, meta, files, reserved) being read
+    try:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='import') as pool:
+            try:
+                with tarfile.open(fileobj=gzip.GzipFile(fileobj=source, mode='rb'), mode='r|', ignore_zeros=True) as tar:
+                    for member in tar:
+                        if member.name == EXPORT_HEADER_NAME:
+                            header = json.load(tar.extractfile(member))
+                            if header.get('format') != EXPORT_FORMAT:
+                                raise click.ClickException(f"Unsupported export format {header.get('format')}")
+                            progress['total'] = header['projects']
+                            report(progress['done'], progress['total'], 0)
+                        elif member.name == EXPORT_DATABASE_NAME:
+                            if database_restored:
+                                continue
+                            with tempfile.TemporaryDirectory() as tmp:
+                                path = os.path.join(tmp, EXPORT_DATABASE_NAME)
+                                with open(path, 'wb') as f:
+                                    shutil.copyfileobj(tar.extractfile(member), f, CHUNK_SIZE)
+                                restore_database(path)
+                            upgrade_schema()  # archives from older versions
+                            if journal is not None:
+                                append_journal(journal, None, {'database': True})
+                        elif member.name.endswith('/project.json'):
+                            submit(project)
+                            project = None
+                            index = int(member.name.split('/')[1])
+                            meta = json.load(tar.extractfile(member))
+                            if index in done:
+                                continue
+                            if not (import_project_name(meta['username']) and import_project_name(meta['project'])):
+                                failures.append(f"{meta['username']}/{meta['project']}: invalid name")
+                                continue
+                            # Reserve the whole project up front: this thread must not
+                            # wait for budget while it holds some
+                            project = (index, meta, {}, budget.acquire(meta['size']))
+                        elif project is not None and member.isfile():
+                            name = archive_member_name(member.name.split('/files/', 1)[-1])
+                            if name is not None:
+                                project[2][name] = tar.extractfile(member).read()
+                    submit(project)
+                    project = None
+            except (EOFError, tarfile.ReadError, zlib.error, gzip.BadGzipFile) as e:
+                if project is not None:
+                    budget.release(project[3])
+                failures.append(f"archive ends early or is damaged ({e}); re-run with --resume once it is complete")
+    finally:
+        if source is not sys.stdin.buffer:
+            source.close()
+        if journal is not None:
+            journal.close()
+    if journal is not None and not failures:
+        os.remove(journal_path)
+    return progress['written'], failures
+
+# -------------------- CLI --------------------
+
+@bp.cli.command('migrate-storage')
+@click.option('--source', default=PROJECTS_FOLDER, show_default=True, help='Existing projects/ tree.')
+@click.option('--dest', default='storage', show_default=True, help='Content-addressed store to fill.')
+def migrate_storage(source, dest):
+    """Copy a plain projects/ tree into the content-addressed store."""
+    src = DirectoryStorage(source)
+    dst = ContentAddressedStorage(dest)
+    migrated = skipped = 0
+    for username, project_name in src.iter_projects():
+        manifest = src.read_manifest(username, project_name) or {}
+        existing = dst.read_manifest(username, project_name) or {}
+        # Safe to re-run: projects already copied with identical content are skipped
+        if {k: v['etag'] for k, v in existing.items()} == {k: v['etag'] for k, v in manifest.items()}:
+            skipped += 1
+            continue
+        files = {name: src.read_file(username, project_name, name) for name in manifest}
+        dst.write_project(username, project_name, files)
+        migrated += 1
+        click.echo(f"{username}/{project_name}: {len(files)} files")
+    click.echo(f"Migrated {migrated} projects ({skipped} already up to date).")
+    click.echo(f"Start the app with STORAGE_BACKEND=cas STORAGE_PATH={dest} to serve from it.")
+
+@bp.cli.command('init-db')
+def init_db():
+    """Create the database and storage directory for a new install."""
+    os.makedirs(current_app.config['STORAGE_PATH'], exist_ok=True)
+    db.create_all()
+    upgrade_schema()
+    click.echo(f"Database at schema version {SCHEMA_VERSION}.")
+
+@bp.cli.command('migrate-db')
+def migrate_db():
+    """Create missing tables and indexes and upgrade the schema."""
+    db.create_all()
+    upgrade_schema()
+    click.echo(f"Database at schema version {SCHEMA_VERSION}.")
+
+@bp.cli.command('build-assets')
+def build_assets_command():
+    """Write content-hashed copies of static/src and the asset manifest."""
+    os.makedirs(current_app.config['ASSETS_PATH'], exist_ok=True)
+    for name, hashed in build_assets().items():
+        click.echo(f"{name} -> /assets/{hashed}")
+
+@bp.cli.command('vendor-assets')
+@click.option('--force', is_flag=True, help='Download packages that are already vendored again.')
+def vendor_assets(force):
+    """Download Monaco, Font Awesome and Inter into ASSETS_PATH, then build."""
+    os.makedirs(current_app.config['ASSETS_PATH'], exist_ok=True)
+    for name in VENDOR_PACKAGES:
+        target = os.path.join(current_app.config['ASSETS_PATH'], vendor_dir(name))
+        if os.path.isdir(target):
+            if not force:
+                click.echo(f"{vendor_dir(name)}: already vendored")
+                continue
+            shutil.rmtree(target)
+        try:
+            click.echo(f"{vendor_dir(name)}: {vendor_package(name)} files")
+        except VendorError as e:
+            raise click.ClickException(str(e))
+    for name, hashed in build_assets().items():
+        click.echo(f"{name} -> /assets/{hashed}")
+
+def transfer_report(verb):
+    """Progress line on stderr for export/import."""
+    started = time.monotonic()
+
+    def report(done, total, size):
+        rate = size / max(time.monotonic() - started, 1e-6) / 1e6
+        click.echo(f"\r{verb} {done}/{total} projects, {size / 1e6:.1f} MB ({rate:.1f} MB/s)", nl=False, err=True)
+    return report
+
+def transfer_summary(verb, written, failures):
+    click.echo(err=True)
+    for failure in failures:
+        click.echo(f"failed: {failure}", err=True)
+    click.echo(f"{verb} {written} projects" + (f", {len(failures)} failed (re-run with --resume)" if failures else "."),
+               err=True)
+    if failures:
+        sys.exit(1)
+
+@bp.cli.command('export')
+@click.argument('archive')
+@click.option('--workers', type=int, default=4, show_default=True, help='Projects read in parallel.')
+@click.option('--buffer', 'buffer_mb', type=int, default=64, show_default=True, help='File data held in memory, in MB.')
+@click.option('--resume', is_flag=True, help='Continue an interrupted export into the same archive.')
+def export_command(archive, workers, buffer_mb, resume):
+    """Write the database and every project to a .tar.gz ('-' for stdout)."""
+    written, failures = export_instance(archive, workers, buffer_mb * 1024 * 1024, resume, transfer_report('Exported'))
+    transfer_summary('Exported', written, failures)
+
+@bp.cli.command('import')
+@click.argument('archive')
+@click.option('--workers', type=int, default=4, show_default=True, help='Projects written in parallel.')
+@click.option('--buffer', 'buffer_mb', type=int, default=64, show_default=True, help='File data held in memory, in MB.')
+@click.option('--resume', is_flag=True, help='Continue an interrupted import of the same archive.')
+def import_command(archive, workers, buffer_mb, resume):
+    """Restore an archive made by `export` into an empty instance ('-' for stdin)."""
+    written, failures = import_instance(archive, workers, buffer_mb * 1024 * 1024, resume, transfer_report('Imported'))
+    transfer_summary('Imported', written, failures)
+
+@bp.cli.command('gc-storage')
+@click.option('--keep', type=int, default=None, help='Versions to keep per project (default DEPLOY_KEEP_VERSIONS).')
+def gc_storage(keep):
+    """Prune old deploy versions of every project and reclaim their space."""
+    keep = keep or current_app.config['DEPLOY_KEEP_VERSIONS']
+    pruned = sum(storage.collect_garbage(username, project_name, keep)
+                 for username, project_name in list(storage.iter_projects()))
+    freed = storage.compact()
+    click.echo(f"Pruned {pruned} versions, freed {freed} bytes.")
+
+# -------------------- APP FACTORY --------------------
+# Importing this module has no side effects: no app, no database connection,
+# no files or threads. create_app() builds an app from load_config() plus the
+# environment and `config`; the schema is set up explicitly with
+# `flask --app julu init-db` (or migrate-db on upgrades).
+#
+# Under gunicorn --preload (see gunicorn.conf.py) the parent process imports
+# the app and compiles the templates once, and every forked worker calls
+# reset_after_fork() to get its own DB connections, thread pools and caches.
+#
+# Everything an app owns at runtime lives in a Runtime in
+# app.extensions['julu']; the module-level names (storage, site_cache, ...)
+# are proxies that find it through current_app, so apps never share state.
+
+_apps = weakref.WeakSet()
+
+def create_app(config=None):
+    app = Flask(__name__)
+    load_config(app)
+    app.config.from_prefixed_env('JULU')
+    app.config.update(config or {})
+    if not app.config['STORAGE_PATH']:
+        app.config['STORAGE_PATH'] = PROJECTS_FOLDER if app.config['STORAGE_BACKEND'] == 'directory' else 'storage'
+    if not app.config['DEPLOY_LOCK_PATH']:
+        app.config['DEPLOY_LOCK_PATH'] = os.path.join(app.instance_path, 'deploy-locks')
+    if app.config['SQLALCHEMY_DATABASE_URI'] not in ('sqlite://', 'sqlite:///:memory:'):
+        app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', app.config['DB_POOL_OPTIONS'])
+
+    if app.config['TRUSTED_PROXIES']:
+        hops = app.config['TRUSTED_PROXIES']
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=hops, x_proto=hops)
+
+    db.init_app(app)
+    with app.app_context():
+        for engine in db.engines.values():  # created here, but not connected yet
+            event.listen(engine, 'connect', functools.partial(set_sqlite_pragmas, app.config['SQLITE_PRAGMAS']))
+            event.listen(engine, 'before_cursor_execute', start_query_timer)
+            event.listen(engine, 'after_cursor_execute', stop_query_timer)
+            event.listen(engine, 'handle_error', drop_query_timer)
+    app.jinja_loader = DictLoader(TEMPLATES)
+    app.register_blueprint(bp)
+    init_runtime(app)
+    _apps.add(app)
+    return app
+
+class Runtime:
+    """One app's caches, thread pools, limiters and storage."""
+
+    def __init__(self, config):
+        self.user_cache = TTLCache(config['IDENTITY_CACHE_TTL'], config['IDENTITY_CACHE_MAX_ENTRIES'])
+        self.project_list_cache = TTLCache(config['IDENTITY_CACHE_TTL'], config['IDENTITY_CACHE_MAX_ENTRIES'])
+        self.password_executor = ThreadPoolExecutor(max_workers=config['PASSWORD_WORKERS'], thread_name_prefix='password')
+        self.password_slots = threading.BoundedSemaphore(config['PASSWORD_WORKERS'] + config['PASSWORD_QUEUE'])
+        self.dummy_password_hash = None
+        self.login_ip_limiter = TokenBucketLimiter(*config['LOGIN_RATE_LIMIT_IP'])
+        self.login_username_limiter = TokenBucketLimiter(*config['LOGIN_RATE_LIMIT_USERNAME'])
+        self.signup_ip_limiter = TokenBucketLimiter(*config['SIGNUP_RATE_LIMIT_IP'])
+        self.storage = LazyStorage(config['STORAGE_BACKEND'], config['STORAGE_PATH'])
+        self.gc_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='storage-gc')
+        self.site_cache = SiteCache(config['SITE_CACHE_MAX_ENTRIES'], config['SITE_CACHE_MAX_BYTES'],
+                                    config['SITE_CACHE_REVALIDATE_SECONDS'])
+        self.deploy_executor = ThreadPoolExecutor(max_workers=config['DEPLOY_WORKERS'], thread_name_prefix='deploy')
+        self.project_locks = {}  # deploy lock name -> threading.Lock, see project_deploy_lock
+        self.project_locks_guard = threading.Lock()
+        self.ide_shell = None  # (body, etag), see ide_shell()
+        self.asset_manifest = None
+
+def init_runtime(app):
+    """(Re)creates the app's Runtime; rendered pages survive a fork."""
+    previous = app.extensions.get('julu')
+    state = app.extensions['julu'] = Runtime(app.config)
+    if previous is not None:
+        state.ide_shell = previous.ide_shell
+        state.asset_manifest = previous.asset_manifest
+
+def warm_up(app):
+    """Compiles every template and renders the IDE shell, so forked workers share them."""
+    with app.app_context():
+        for name in TEMPLATES:
+            app.jinja_env.get_template(name)
+        ide_shell()
+
+def reset_after_fork(app=None):
+    """Gives a freshly forked worker its own connections, threads and caches.
+
+    Pooled connections inherited from the parent are dropped without being
+    closed (the parent still owns them); compiled templates are kept.
+    """
+    for app in ([app] if app is not None else list(_apps)):
+        with app.app_context():
+            for engine in db.engines.values():
+                engine.dispose(close=False)
+        init_runtime(app)
 
 if __name__ == '__main__':
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        upgrade_schema()
     app.run(debug=True)
\ No newline at end of file